@@ -0,0 +1,83 @@
+import argparse
+import math
+import timeit
+from types import SimpleNamespace
+import numpy as np
+from handtracker import HandTracker
+
+
+def make_detections(rng: np.random.Generator, num_hands: int) -> list:
+    """
+    Create MediaPipe-like landmark results for random hands.
+
+    :param rng: random generator
+    :param num_hands: number of detected hands
+    :return: list of hands, each with 21 landmarks with x, y and z attributes
+    """
+    detections = []
+    for _ in range(num_hands):
+        centre = rng.uniform(0.2, 0.8, size=3)
+        points = centre + rng.normal(scale=0.03, size=(21, 3))
+        detections.append(SimpleNamespace(landmark=[SimpleNamespace(x=x, y=y, z=z) for x, y, z in points]))
+    return detections
+
+def legacy_association(last_left: np.array, last_right: np.array, detections: list) -> tuple:
+    """
+    Previous per-hand conversion and greedy association for more than two hands.
+
+    :param last_left: last left hand
+    :param last_right: last right hand
+    :param detections: MediaPipe-like landmark results
+    :return: new left and right hands
+    """
+    best_left_dist, best_right_dist = math.inf, math.inf
+    for hand in detections:
+        hand_vector = np.transpose(np.array([[landmark.x, landmark.y, landmark.z] for landmark in hand.landmark]))
+        left_dist = ((last_left - hand_vector) ** 2).sum()
+        right_dist = ((last_right - hand_vector) ** 2).sum()
+        if left_dist < best_left_dist:
+            last_left = hand_vector
+            best_left_dist = left_dist
+        if right_dist < best_right_dist:
+            last_right = hand_vector
+            best_right_dist = right_dist
+    return last_left, last_right
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and vectorized hand association")
+    parser.add_argument("--hands", type=int, nargs="+", default=[3, 4, 6], help="numbers of detected hands")
+    parser.add_argument("--repeats", type=int, default=2000, help="repetitions per measurement")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    hand_tracker = HandTracker(roi_tracking=False, num_operators=1)
+
+    for num_hands in args.hands:
+        detections = make_detections(rng, num_hands)
+        last_left = hand_tracker._get_vectors_from_landmarks(detections[:1])[0]
+        last_right = hand_tracker._get_vectors_from_landmarks(detections[1:2])[0]
+        scores = np.ones(num_hands, dtype=np.float32)
+
+        def vectorized():
+            hand_tracker._last_hands[0] = last_left, last_right
+            hand_tracker._assign_hands(hand_tracker._get_vectors_from_landmarks(detections), scores)
+
+        legacy_time = timeit.timeit(lambda: legacy_association(last_left, last_right, detections), number=args.repeats)
+        vectorized_time = timeit.timeit(vectorized, number=args.repeats)
+        print(f"{num_hands} hands: legacy {1e6 * legacy_time / args.repeats:.1f} us, "
+              f"vectorized {1e6 * vectorized_time / args.repeats:.1f} us")
+
+    # how often the greedy association gives the same hand to both slots
+    conflicts = 0
+    trials = 1000
+    for _ in range(trials):
+        detections = make_detections(rng, 3)
+        last_left, last_right = make_detections(rng, 1), make_detections(rng, 1)
+        last_left = hand_tracker._get_vectors_from_landmarks(last_left)[0]
+        last_right = hand_tracker._get_vectors_from_landmarks(last_right)[0]
+        left, right = legacy_association(last_left, last_right, detections)
+        conflicts += np.array_equal(left, right)
+    print(f"legacy association gave both slots the same hand in {conflicts} of {trials} random frames")
+
+if __name__ == "__main__":
+    main()
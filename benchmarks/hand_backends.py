@@ -0,0 +1,54 @@
+import argparse
+import time
+import numpy as np
+from benchmarks.hand_tracking_modes import load_rgb_frames
+from handtracker import HandTracker
+
+
+def run_backend(backend: str, mode: str, frames: list) -> tuple:
+    """
+    Track hands in all frames with a hand landmark backend.
+
+    :param backend: hand landmark backend, mediapipe or onnx
+    :param mode: hand tracking mode
+    :param frames: RGB frames
+    :return: per-frame latencies [ms] and hand poses
+    """
+    # ROI cropping is disabled so only the backend differs
+    hand_tracker = HandTracker(mode=mode, roi_tracking=False, backend=backend)
+    latencies = []
+    poses = []
+    for frame in frames:
+        start = time.perf_counter()
+        poses.append(hand_tracker.get_hand_poses_from_frame(frame))
+        latencies.append(1000 * (time.perf_counter() - start))
+    return np.array(latencies), np.array(poses)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare latency and landmark agreement of the hand landmark backends")
+    parser.add_argument("path", help="video file or .npy stack of BGR frames")
+    parser.add_argument("--frames", type=int, default=600, help="maximum number of frames")
+    parser.add_argument("--step", type=int, default=3, help="keep one frame every step frames (SKIP_FRAMES + 1)")
+    parser.add_argument("--mode", default="video", choices=["image", "video"], help="hand tracking mode")
+    args = parser.parse_args()
+
+    frames = load_rgb_frames(args.path, args.frames, args.step)
+    print(f"{len(frames)} frames loaded")
+
+    results = {}
+    for backend in ["mediapipe", "onnx"]:
+        latencies, poses = run_backend(backend, args.mode, frames)
+        results[backend] = poses
+        found = (np.abs(poses).sum(axis=1) > 0.001).all(axis=1)
+        print(f"{backend:>9}: mean {latencies.mean():.1f} ms, median {np.median(latencies):.1f} ms, "
+              f"p95 {np.percentile(latencies, 95):.1f} ms, both hands found in {found.mean():.1%} of frames")
+
+    # agreement with MediaPipe on frames where both backends found both hands
+    found = (np.abs(results["mediapipe"]).sum(axis=1) > 0.001).all(axis=1) & \
+            (np.abs(results["onnx"]).sum(axis=1) > 0.001).all(axis=1)
+    if found.any():
+        difference = np.abs(results["mediapipe"][found] - results["onnx"][found]).mean()
+        print(f"mean landmark difference to mediapipe: {difference:.5f} ({found.sum()} frames)")
+
+if __name__ == "__main__":
+    main()
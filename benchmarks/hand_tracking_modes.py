@@ -0,0 +1,78 @@
+import argparse
+import time
+import numpy as np
+import cv2 as cv
+from frame_source import ReplaySource
+from handtracker import HandTracker
+
+
+def load_rgb_frames(path: str, max_frames: int, step: int) -> list:
+    """
+    Read frames of a recording and convert them to RGB.
+
+    :param path: video file or .npy stack of BGR frames
+    :param max_frames: maximum number of frames to read
+    :param step: keep one frame every step frames
+    :return: list of RGB frames
+    """
+    frames = []
+    source = ReplaySource(path, realtime=False)
+    source.start()
+    try:
+        while len(frames) < max_frames:
+            bgr_frame, _, sequence = source.read()
+            if sequence % step == 0:
+                frames.append(cv.cvtColor(bgr_frame, cv.COLOR_BGR2RGB))
+    except EOFError:
+        pass
+    finally:
+        source.stop()
+    return frames
+
+def run_tracker(mode: str, frames: list) -> tuple:
+    """
+    Track hands in all frames.
+
+    :param mode: hand tracking mode
+    :param frames: RGB frames
+    :return: per-frame latencies [ms] and hand poses
+    """
+    # ROI cropping is disabled so only the tracking mode differs
+    hand_tracker = HandTracker(mode=mode, roi_tracking=False)
+    latencies = []
+    poses = []
+    for frame in frames:
+        start = time.perf_counter()
+        poses.append(hand_tracker.get_hand_poses_from_frame(frame))
+        latencies.append(1000 * (time.perf_counter() - start))
+    return np.array(latencies), np.array(poses)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare latency and landmark stability of the hand tracking modes")
+    parser.add_argument("path", help="video file or .npy stack of BGR frames")
+    parser.add_argument("--frames", type=int, default=600, help="maximum number of frames")
+    parser.add_argument("--step", type=int, default=3, help="keep one frame every step frames (SKIP_FRAMES + 1)")
+    args = parser.parse_args()
+
+    frames = load_rgb_frames(args.path, args.frames, args.step)
+    print(f"{len(frames)} frames loaded")
+
+    results = {}
+    for mode in ["image", "video"]:
+        latencies, poses = run_tracker(mode, frames)
+        results[mode] = poses
+
+        # stability measured as the mean landmark displacement between consecutive frames
+        jitter = np.abs(np.diff(poses, axis=0)).mean() if len(poses) > 1 else 0.0
+        print(f"{mode:>5}: mean {latencies.mean():.1f} ms, median {np.median(latencies):.1f} ms, "
+              f"p95 {np.percentile(latencies, 95):.1f} ms, frame-to-frame displacement {jitter:.5f}")
+
+    # agreement between modes on frames where both modes found both hands
+    found = (np.abs(results["image"]).sum(axis=1) > 0.001).all(axis=1) & \
+            (np.abs(results["video"]).sum(axis=1) > 0.001).all(axis=1)
+    if found.any():
+        difference = np.abs(results["image"][found] - results["video"][found]).mean()
+        print(f"mean landmark difference between modes: {difference:.5f} ({found.sum()} frames)")
+
+if __name__ == "__main__":
+    main()
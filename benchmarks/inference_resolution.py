@@ -0,0 +1,51 @@
+import argparse
+import os
+import time
+import numpy as np
+from benchmarks.hand_tracking_modes import load_rgb_frames
+from handtracker import HandTracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare hand tracking latency and landmark drift at several inference scales")
+    parser.add_argument("path", help="video file or .npy stack of BGR frames")
+    parser.add_argument("--frames", type=int, default=300, help="maximum number of frames")
+    parser.add_argument("--step", type=int, default=3, help="keep one frame every step frames (SKIP_FRAMES + 1)")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.35, 0.25], help="inference scales")
+    args = parser.parse_args()
+
+    frames = load_rgb_frames(args.path, args.frames, args.step)
+    print(f"{len(frames)} frames loaded")
+
+    # landmarks are compared after the normalisation used by the models
+    min_vector = np.transpose(np.load(os.path.join("settings", "min_vector.npy")).reshape((-1, 3)))
+    max_vector = np.transpose(np.load(os.path.join("settings", "max_vector.npy")).reshape((-1, 3)))
+
+    reference = None
+    for scale in sorted(args.scales, reverse=True):
+        # each frame is tracked on its own so the scales see the same frames
+        hand_tracker = HandTracker(mode="image", roi_tracking=False, inference_scale=scale)
+        latencies = []
+        poses = []
+        found = []
+        for frame in frames:
+            hand_tracker.reset()
+            start = time.perf_counter()
+            hand_poses = hand_tracker.get_hand_poses_from_frame(frame)
+            latencies.append(1000 * (time.perf_counter() - start))
+            found.append((np.abs(hand_poses).sum(axis=0) > 0.001).all())
+            poses.append((hand_poses - min_vector) / (max_vector - min_vector))
+        latencies, poses, found = np.array(latencies), np.array(poses), np.array(found)
+
+        if reference is None:
+            reference = (scale, latencies.mean(), poses, found)
+
+        # drift measured on frames where both hands were found at this and at the reference scale
+        both = found & reference[3]
+        drift = np.abs(poses[both] - reference[2][both]).mean() if both.any() else float("nan")
+        print(f"scale {scale:.2f}: mean {latencies.mean():.1f} ms ({reference[1] - latencies.mean():+.1f} ms saved), "
+              f"p95 {np.percentile(latencies, 95):.1f} ms, both hands in {found.mean():.0%} of frames, "
+              f"drift vs scale {reference[0]:.2f}: {drift:.4f}")
+
+if __name__ == "__main__":
+    main()
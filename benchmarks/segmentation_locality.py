@@ -0,0 +1,48 @@
+import argparse
+import numpy as np
+import torch
+from settings import constants
+from model import get_device, load_models
+
+
+def get_first_block_activations(model: torch.nn.Module, sequences: torch.Tensor) -> torch.Tensor:
+    """
+    Run the spatial graph convolution of the first AAGCN block, the last layer before any temporal stride.
+
+    :param model: segmentation model
+    :param sequences: windows [windows, 3, S_SEQ_LEN, 42]
+    :return: activations [windows, channels, S_SEQ_LEN, 42]
+    """
+    return model.aagcn_layers[0].gcn1(sequences)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how much the activations of a frame change when the segmentation "
+                                                 "window moves, i.e. the error of caching per-frame activations")
+    parser.add_argument("path", help="landmark archive [frames, 3, 42] written by extract_landmarks.py")
+    parser.add_argument("--frames", type=int, default=600, help="maximum number of frames")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="relative error a streaming mode could accept")
+    args = parser.parse_args()
+
+    device = get_device()
+    _, segmentation_models = load_models(device)
+    hand_poses = np.load(args.path).astype(np.float32)[:args.frames]
+
+    # consecutive windows as in the model process, each one shifted by one frame
+    windows = np.lib.stride_tricks.sliding_window_view(hand_poses, constants.S_SEQ_LEN, axis=0)
+    sequences = torch.from_numpy(np.ascontiguousarray(windows.transpose(0, 1, 3, 2))).to(device)
+    print(f"{len(sequences)} windows of {constants.S_SEQ_LEN} frames")
+
+    with torch.inference_mode():
+        for i, model in enumerate(segmentation_models):
+            activations = get_first_block_activations(model, sequences)
+
+            # frames shared by consecutive windows, a cache would reuse the activations of the previous window
+            previous = activations[:-1, :, 1:]
+            current = activations[1:, :, :-1]
+            error = (torch.linalg.vector_norm(current - previous, dim=(1, 2, 3)) /
+                     torch.linalg.vector_norm(current, dim=(1, 2, 3)).clamp_min(1e-12)).cpu().numpy()
+            print(f"segmentation model {i}: relative error of cached first-block activations mean {error.mean():.2e}, "
+                  f"max {error.max():.2e}, {np.mean(error <= args.tolerance):.1%} of the windows within {args.tolerance:.0e}")
+
+if __name__ == "__main__":
+    main()
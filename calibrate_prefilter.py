@@ -0,0 +1,106 @@
+import argparse
+import glob
+import os
+import numpy as np
+import torch
+from settings import constants
+from model import ModelEnsemble, get_device, load_models
+from prefilter import get_velocity_energy
+
+
+def segment_archive(hand_poses: np.array, segmentation_ensemble: ModelEnsemble, device: torch.device, batch_size: int) -> np.array:
+    """
+    Segment every frame of a landmark archive with the segmentation ensemble, as the model process does.
+
+    :param hand_poses: normalised landmarks [frames, 3, 42]
+    :param segmentation_ensemble: segmentation models
+    :param device: device the models run on
+    :param batch_size: number of sequences per forward pass
+    :return: ensemble segmentation of each frame, human movement (0) or static (1)
+    """
+    # sequence ending at each frame, starting from zeros like the sequence of the model process
+    padded = np.concatenate((np.zeros((constants.S_SEQ_LEN - 1, 3, 42), dtype=np.float32), hand_poses))
+    sequences = np.lib.stride_tricks.sliding_window_view(padded, constants.S_SEQ_LEN, axis=0)
+
+    labels = []
+    with torch.inference_mode():
+        for start in range(0, len(sequences), batch_size):
+            # [batch, 3, 42, sequence] to the model layout [batch, 3, sequence, 42]
+            batch = torch.from_numpy(np.ascontiguousarray(sequences[start:start + batch_size].transpose(0, 1, 3, 2))).to(device)
+            preds = torch.sigmoid(segmentation_ensemble(batch).squeeze(-1))
+            labels.append((preds.mean(dim=0) > 0.5).float().cpu().numpy())
+    return np.concatenate(labels)
+
+def find_threshold(energy: np.array, labels: np.array, label: int, agreement: float) -> float:
+    """
+    Find the widest energy threshold whose decisions agree with the ensemble.
+
+    :param energy: velocity energy of each frame
+    :param labels: ensemble segmentation of each frame
+    :param label: 1 for the static threshold (energies below it), 0 for the moving threshold (energies above it)
+    :param agreement: minimum fraction of decided frames on which the prefilter agrees with the ensemble
+    :return: threshold, -inf or inf if no threshold reaches the agreement
+    """
+    # static frames are decided from the lowest energy upwards, moving frames from the highest downwards
+    order = np.argsort(energy) if label == 1 else np.argsort(-energy)
+    matches = np.cumsum(labels[order] == label) / np.arange(1, len(order) + 1)
+    valid = np.flatnonzero(matches >= agreement)
+    if len(valid) == 0:
+        return -np.inf if label == 1 else np.inf
+    return float(energy[order[valid[-1]]])
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the kinematic prefilter thresholds against the segmentation ensemble")
+    parser.add_argument("landmark_dir", help="directory with landmark archives [frames, 3, 42] written by extract_landmarks.py")
+    parser.add_argument("--agreement", type=float, default=0.99,
+                        help="minimum agreement with the ensemble of the frames decided by each threshold")
+    parser.add_argument("--window", type=int, default=constants.PREFILTER_WINDOW, help="frames of the velocity energy")
+    parser.add_argument("--batch-size", type=int, default=256, help="sequences per forward pass")
+    args = parser.parse_args()
+
+    device = get_device()
+    _, segmentation_models = load_models(device)
+    if not segmentation_models:
+        raise FileNotFoundError("No segmentation models found in models/segmentation")
+    segmentation_ensemble = ModelEnsemble(segmentation_models)
+
+    # velocity energy and ensemble segmentation of every frame with a full prefilter window
+    energies = []
+    labels = []
+    paths = sorted(glob.glob(os.path.join(args.landmark_dir, "**", "*.npy"), recursive=True))
+    for path in paths:
+        hand_poses = np.load(path).astype(np.float32)
+        if len(hand_poses) < args.window:
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(hand_poses, args.window, axis=0)
+        energies.append(get_velocity_energy(np.moveaxis(windows, -1, 0)))
+        labels.append(segment_archive(hand_poses, segmentation_ensemble, device, args.batch_size)[args.window - 1:])
+        print(f"{path}: {len(hand_poses)} frames")
+    if not energies:
+        print("No landmark archives with enough frames found")
+        return
+    energy = np.concatenate(energies)
+    labels = np.concatenate(labels)
+
+    static_energy = find_threshold(energy, labels, 1, args.agreement)
+    moving_energy = find_threshold(energy, labels, 0, args.agreement)
+
+    # overlapping thresholds would give both labels, the uncertain band collapses to the midpoint
+    if static_energy >= moving_energy:
+        print(f"Thresholds overlap (static {static_energy:.3g}, moving {moving_energy:.3g}), using their midpoint")
+        moving_energy = (static_energy + moving_energy) / 2
+        static_energy = np.nextafter(moving_energy, -np.inf)
+
+    static = energy <= static_energy
+    moving = energy >= moving_energy
+    decided = static | moving
+    agreement = ((static & (labels == 1)) | (moving & (labels == 0))).sum() / max(decided.sum(), 1)
+    print(f"{len(energy)} frames, {labels.mean():.1%} static according to the ensemble")
+    print(f"PREFILTER_WINDOW = {args.window}")
+    print(f"PREFILTER_STATIC_ENERGY = {static_energy:.6g}")
+    print(f"PREFILTER_MOVING_ENERGY = {moving_energy:.6g}")
+    print(f"prefilter decides {decided.mean():.1%} of the frames ({static.mean():.1%} static, {moving.mean():.1%} moving), "
+          f"agreeing with the ensemble on {agreement:.2%}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
-import pyrealsense2 as rs
 import numpy as np
 import time
 import logging
 from settings import constants
 from handtracker import HandTracker
-import os
+from frame_source import FrameSource, create_frame_source
+from frame_sampler import get_frame_sampler
+from tracking_stage import create_tracking_stage
+from scene_detector import SceneChangeDetector
+from landmark_buffer import REUSED_FLAG, KEEP_ALIVE_FLAG, get_landmark_shape
+from shared_frames import FrameBus
+from governor import GovernorState, StageLatency, get_degradation_setting
+from preprocessing import load_normalisation_vectors, LandmarkPreprocessor, AllocationMonitor, CameraCalibration
+import threading
 import cv2 as cv
 
 
@@ -22,93 +29,291 @@ def get_hand_tracker():
     hand_tracker.reset()
     return hand_tracker
 
-def camera_loop(frame_queue, stop_event):
+# single-slot buffer shared between the capture thread and the tracking stage
+class LatestFrameSlot:
+    def __init__(self, lossless: bool = False):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._timestamp = 0.0
+        self._sequence = -1
+        self._arrival = 0.0
+        self._closed = False
+
+        # frames no longer in use, recycled by the capture thread instead of allocating a frame per capture
+        self._spare_frames = []
+        self._taken_frame = None
+
+        # if lossless the capture thread waits for each frame to be taken instead of replacing it
+        self._lossless = lossless
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def get_buffer(self, shape: tuple):
+        """
+        Get a frame buffer no longer in use, to be filled and stored with put.
+
+        :param shape: shape of the frame
+        :return: frame buffer or None if there is no spare buffer with the given shape
+        """
+        with self._condition:
+            while self._spare_frames:
+                frame = self._spare_frames.pop()
+                if frame.shape == shape:
+                    return frame
+            return None
+
+    def put(self, frame: np.array, timestamp: float, sequence: int) -> None:
+        """
+        Store a new frame, replacing the previous one if it was not taken yet.
+
+        :param frame: RGB frame
+        :param timestamp: capture timestamp [s]
+        :param sequence: capture sequence number
+        """
+        with self._condition:
+            if self._lossless:
+                self._condition.wait_for(lambda: self._closed or self._frame is None)
+            if self._frame is not None:
+                self._spare_frames.append(self._frame)
+            self._frame, self._timestamp, self._sequence = frame, timestamp, sequence
+            self._arrival = time.perf_counter()
+            self._condition.notify_all()
+
+    def get(self, min_sequence: int, timeout: float):
+        """
+        Take the newest frame once its sequence number reaches min_sequence.
+
+        :param min_sequence: lowest sequence number accepted
+        :param timeout: maximum waiting time [s]
+        :return: tuple (frame, timestamp, sequence, arrival time) or None on timeout or when the slot was closed,
+            the frame is only valid until the next call
+        """
+        with self._condition:
+            while True:
+                self._condition.wait_for(lambda: self._closed or (self._frame is not None and
+                                         (self._lossless or self._sequence >= min_sequence)), timeout)
+                if self._frame is None:
+                    return None
+
+                # in lossless mode frames before min_sequence are taken and discarded
+                if self._sequence < min_sequence:
+                    if not self._lossless:
+                        return None
+                    self._spare_frames.append(self._frame)
+                    self._frame = None
+                    self._condition.notify_all()
+                    continue
+
+                # the frame taken before is no longer in use
+                if self._taken_frame is not None:
+                    self._spare_frames.append(self._taken_frame)
+                frame, self._frame = self._frame, None
+                self._taken_frame = frame
+                self._condition.notify_all()
+                return frame, self._timestamp, self._sequence, self._arrival
+
+    def close(self) -> None:
+        """
+        Wake up any waiting thread and stop accepting frames.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+def capture_loop(frame_source: FrameSource, frame_slot: LatestFrameSlot, stop_event, frame_bus: FrameBus = None):
+    """
+    Capture thread, moves the newest frame of the source into the frame slot.
+
+    :param frame_source: source of BGR frames
+    :param frame_slot: slot read by the tracking stage
+    :param stop_event: event to stop the thread
+    :param frame_bus: bus where every frame is published for other consumers, None to not publish frames
+    """
     try:
-        # variable to subsample video
-        frame_count = 0
+        while not stop_event.is_set() and not frame_slot.closed:
+            frame = frame_source.read()
+            if frame is None:
+                continue
+            bgr_frame, timestamp, sequence = frame
 
-        # initialize pipeline and config
-        pipeline = rs.pipeline()
-        config = rs.config()
+            # convert frame into a recycled buffer, the copy releases the source frame back to its pool
+            rgb_frame = cv.cvtColor(bgr_frame, cv.COLOR_BGR2RGB, dst=frame_slot.get_buffer(bgr_frame.shape))
 
-        # Get device product line for setting a supporting resolution
-        pipeline_wrapper = rs.pipeline_wrapper(pipeline)
-        try:
-            pipeline_profile = config.resolve(pipeline_wrapper)
-        except RuntimeError:
-            raise
+            # publish every frame to other consumers, frames are dropped if they hold every slot
+            if frame_bus is not None:
+                frame_bus.publish(rgb_frame, timestamp, sequence)
 
-        device = pipeline_profile.get_device()
+            frame_slot.put(rgb_frame, timestamp, sequence)
 
-        # check if camera has the necessary capabilities
-        found_rgb = False
-        for s in device.sensors:
-            if s.get_info(rs.camera_info.name) == 'RGB Camera':
-                found_rgb = True
-                break
-        if not found_rgb:
-            raise IOError("RGB camera not found!")
+    except EOFError:
+        logger.info("Frame source finished")
+    except Exception:
+        logger.error("Capture thread error", exc_info=True)
+    finally:
+        frame_slot.close()
 
-        config.enable_stream(rs.stream.color, constants.STREAM_WIDTH, constants.STREAM_HEIGHT, rs.format.bgr8, constants.STREAM_FPS)
+def camera_loop(landmark_buffer, stop_event, moving_flag=None, motion_end=None, frame_bus=None, camera=None,
+                governor_state: GovernorState = None, camera_index: int = 0):
+    try:
+        # initialize frame source (RealSense camera or replay of a recording) and, with several cameras,
+        # the transform of its landmarks into the coordinates of the reference camera
+        frame_source = create_frame_source(camera)
+        calibration = CameraCalibration.load(camera.get("calibration")) if camera is not None else None
 
     except Exception as e:
         logger.error("Camera error initializing", exc_info=e)
         return
   
+    # capture thread and the slot it fills
+    frame_slot = LatestFrameSlot(frame_source.lossless)
+    capture_stop_event = threading.Event()
+    capture_thread = None
+    tracking_stage = None
+
     try:
-        # create hand tracker and start camera stream
+        # create hand tracker, frame sampler, static scene detector and start frame source
         hand_tracker = get_hand_tracker()
-        pipeline.start(config)
+        frame_sampler = get_frame_sampler()
+        scene_detector = SceneChangeDetector() if constants.STATIC_SCENE_DETECTION else None
+        frame_source.start()
+
+        # track hands in this process or in worker processes
+        tracking_stage = create_tracking_stage(hand_tracker, frame_source.frame_shape)
 
-        # load normalisation vectors        
-        min_vector = np.transpose(np.load(os.path.join("settings", "min_vector.npy")).reshape((-1, 3)))
-        max_vector = np.transpose(np.load(os.path.join("settings", "max_vector.npy")).reshape((-1, 3)))
+        # frames larger than the bus slots (e.g. replays recorded at a higher resolution) are not published
+        if frame_bus is not None and np.prod(frame_source.frame_shape) > frame_bus.slot_size:
+            logger.warning(f"Frames with shape {frame_source.frame_shape} do not fit the frame bus, frames are not published")
+            frame_bus = None
 
-        logger.info("Camera started")
+        # start capture thread
+        capture_thread = threading.Thread(target=capture_loop, args=(frame_source, frame_slot, capture_stop_event, frame_bus), daemon=True)
+        capture_thread.start()
+
+        # normalisation into preallocated buffers and, when profiling, allocation tracing
+        preprocessor = LandmarkPreprocessor(*load_normalisation_vectors(), get_landmark_shape(constants.NUM_OPERATORS))
+        allocation_monitor = AllocationMonitor(constants.PROFILE_ALLOCATIONS)
+
+        logger.info("Camera started" if camera is None else f"Camera {camera.get('name', camera.get('serial', camera.get('replay')))} started")
 
         last_heartbeat = time.time()
+        last_sequence = None
+        skipped_frames = 0
+        processed_frames = 0
+        reused_frames = 0
+        last_hand_poses = None
+        last_confidence = None
+        latency_sum = 0.0
+        total_frames = 0
+        keep_alive = False
+        start_time = time.perf_counter()
+
+        # latency reported to the governor in the stage of this camera and degradation level applied
+        stage_latency = StageLatency(governor_state, GovernorState.CAMERA_STAGE + camera_index) if governor_state is not None else None
+        degradation_level = 0
 
         while not stop_event.is_set():
-            # get frame from camera
-            frames = pipeline.wait_for_frames()
-            color_frame = frames.get_color_frame()
-            if not color_frame:
-                continue
-            
-            # process frame
-            color_frame = np.asanyarray(color_frame.get_data())
-            color_frame = cv.cvtColor(color_frame, cv.COLOR_BGR2RGB)
+            allocation_monitor.begin()
+            published_frames = 0
+
+            # follow the degradation level set by the governor
+            if governor_state is not None and governor_state.level.value != degradation_level:
+                degradation_level = governor_state.level.value
+                default_skip = constants.SAMPLER_MIN_SKIP if constants.ADAPTIVE_SAMPLING else constants.SKIP_FRAMES
+                frame_sampler.set_min_skip(get_degradation_setting(degradation_level, "skip_frames", default_skip))
+                tracking_stage.set_model_complexity(get_degradation_setting(degradation_level, "model_complexity", constants.MODEL_COMPLEXITY))
+                logger.info(f"Degradation level {degradation_level} applied")
 
             # reduce framerate, if fps == 30 and SKIP_FRAMES == 2, then true_fps == 10
             # requesting a higher framerate leads to lower motion blur
-            if frame_count == constants.SKIP_FRAMES:
-                frame_count = 0
-
-                # get landmarks from RGB frame
-                hand_poses = hand_tracker.get_hand_poses_from_frame(color_frame)
-
-                # mask hands that were detected (hands not yet detected are represented as zeros)
-                mask = hand_poses.sum(axis=0) > 0.001
-
-                # normalise detected hands
-                hand_poses =  np.where(mask, np.clip((hand_poses - min_vector) / (max_vector - min_vector), 0, 1), hand_poses)
-                
-                # add landmarks to queue
-                if not frame_queue.full():
-                    frame_queue.put(hand_poses)
-                else:
-                    logger.warning("Camera queue full!")
-            else:
-                frame_count += 1
+            # with adaptive sampling the skipped frames follow the hand velocity
+            min_sequence = 0 if last_sequence is None else frame_sampler.next_sequence(last_sequence)
+
+            # while the robot moves hands are only tracked at a keep-alive rate, until shortly before the expected end
+            # of the robot task, so the model has full-rate landmarks again when it wakes up
+            if constants.ROBOT_MOTION_GATING and moving_flag is not None:
+                moving = moving_flag.value and time.time() < motion_end.value - constants.ROBOT_PREROLL_TIME
+                if moving != keep_alive:
+                    logger.info("Robot moving, keep-alive tracking" if moving else "Full-rate tracking")
+                    keep_alive = moving
+                if keep_alive and last_sequence is not None:
+                    min_sequence = max(min_sequence, last_sequence + constants.ROBOT_KEEP_ALIVE_SKIP_FRAMES + 1)
+
+            # get newest RGB frame from the capture thread and submit it for tracking
+            if tracking_stage.has_capacity():
+                frame = frame_slot.get(min_sequence, timeout=0.1 if tracking_stage.idle else 0.005)
+                if frame is None and frame_slot.closed and tracking_stage.idle:
+                    break
+
+                if frame is not None:
+                    color_frame, timestamp, sequence, arrival = frame
+
+                    # count frames lost because tracking fell behind the camera
+                    skipped_frames += sequence - min_sequence if last_sequence is not None else 0
+                    last_sequence = sequence
+
+                    # skip tracking if the scene did not change since the last tracked frame
+                    if scene_detector is not None and scene_detector.is_static(color_frame):
+                        color_frame = None
+
+                    tracking_stage.submit(color_frame, (timestamp, arrival, KEEP_ALIVE_FLAG if keep_alive else 0))
+
+            # get landmarks of tracked frames, in capture order
+            for hand_poses, confidence, (timestamp, arrival, flags) in tracking_stage.collect(timeout=0 if tracking_stage.has_capacity() else 0.1):
+                # reuse landmarks of the previous frame if tracking was skipped
+                if hand_poses is None:
+                    hand_poses, confidence = last_hand_poses, last_confidence
+                    flags |= REUSED_FLAG
+                    reused_frames += 1
+                last_hand_poses, last_confidence = hand_poses, confidence
+
+                frame_sampler.update(hand_poses, timestamp)
+
+                # with several cameras, move the landmarks into the coordinates of the reference camera
+                if calibration is not None:
+                    hand_poses, confidence = calibration.apply(hand_poses, confidence)
+
+                # normalise detected hands and publish landmarks to the model or fusion process (copied into shared memory)
+                landmark_buffer.write(preprocessor.normalise(hand_poses), timestamp, flags, confidence)
+                published_frames += 1
+
+                # latency from frame arrival to published landmarks
+                latency = time.perf_counter() - arrival
+                latency_sum += latency
+                if stage_latency is not None:
+                    stage_latency.add(latency)
+                processed_frames += 1
+                total_frames += 1
+
+            allocation_monitor.end(published_frames)
 
             if time.time() - last_heartbeat > 5:
-                logger.info("Camera running...")
+                logger.info(f"Camera running... processed {processed_frames} frames ({reused_frames} reused), "
+                            f"skipped {skipped_frames}, mean latency {1000 * latency_sum / max(processed_frames, 1):.1f} ms"
+                            + (f", {frame_bus.dropped} frames dropped by the frame bus, {frame_bus.reclaimed} slots reclaimed"
+                               if frame_bus is not None else ""))
+                if allocation_monitor.enabled:
+                    logger.info(f"Camera allocations: {allocation_monitor.summary()}")
+                    allocation_monitor.reset()
                 last_heartbeat = time.time()
+                processed_frames = 0
+                skipped_frames = 0
+                reused_frames = 0
+                latency_sum = 0.0
+
+        # report throughput, mostly useful for replays run as fast as possible
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"Camera processed {total_frames} frames in {elapsed:.1f} s ({total_frames / max(elapsed, 1e-6):.1f} FPS)")
 
     except Exception as e:
         logger.error("Camera error", exc_info=True)
     finally:
-        pipeline.stop()
-        while not frame_queue.empty():
-            frame_queue.get()
+        capture_stop_event.set()
+        frame_slot.close()
+        if capture_thread is not None:
+            capture_thread.join(timeout=2)
+        if tracking_stage is not None:
+            tracking_stage.close()
+        frame_source.stop()
         logger.info("Camera stopped")
@@ -2,6 +2,13 @@ import multiprocessing as mp
 from camera import camera_loop
 from model import model_worker
 from robot import robot_loop
+from landmark_buffer import LandmarkRingBuffer, get_landmark_shape
+from shared_frames import FrameBus
+from fusion import fusion_loop
+from governor import GovernorState, governor_loop
+from preview import preview_loop
+from recorder import recorder_loop
+from settings import constants
 import logging
 
 
@@ -14,28 +21,73 @@ file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 
 def start_system(stop_event, model_ready_event, robot_online_event):
-    # initialize queues and moving flag
+    # initialize landmark buffer, queues, moving flag and expected end of the robot movement
     logger.info("Initializing processes...")
-    frame_queue = mp.Queue(maxsize=20)
+    if constants.CAMERAS and constants.NUM_OPERATORS > 1:
+        raise ValueError("Several operators can only be tracked with a single camera, operators are not matched between cameras")
+    landmark_buffer = LandmarkRingBuffer(constants.LANDMARK_BUFFER_SIZE, get_landmark_shape(constants.NUM_OPERATORS))
     result_queue = mp.Queue()
     moving_flag = mp.Value("b", False)
+    motion_end = mp.Value("d", 0.0)
 
-    # start processes
-    camera_proc = mp.Process(target=camera_loop, args=(frame_queue, stop_event))
-    model_proc = mp.Process(target=model_worker, args=(frame_queue, result_queue, stop_event, model_ready_event, moving_flag))
-    robot_proc = mp.Process(target=robot_loop, args=(result_queue, stop_event, robot_online_event, moving_flag))
+    # state shared with the latency governor
+    governor_state = GovernorState(max(len(constants.CAMERAS), 1)) if constants.LATENCY_GOVERNOR else None
 
-    camera_proc.start()
+    # frame bus, only needed if a process other than the camera reads frames
+    frame_bus = FrameBus(constants.FRAME_BUS_SLOTS, (constants.STREAM_HEIGHT, constants.STREAM_WIDTH, 3), constants.FRAME_BUS_RECLAIM_TIMEOUT) \
+        if constants.FRAME_PREVIEW or constants.RECORDING else None
+
+    # start processes, with several cameras each one has its own landmark buffer read by the fusion process
+    if constants.CAMERAS:
+        camera_buffers = [LandmarkRingBuffer(constants.LANDMARK_BUFFER_SIZE) for _ in constants.CAMERAS]
+        camera_procs = [mp.Process(target=camera_loop, args=(camera_buffer, stop_event, moving_flag, motion_end,
+                                                             frame_bus if i == 0 else None, camera, governor_state, i))
+                        for i, (camera_buffer, camera) in enumerate(zip(camera_buffers, constants.CAMERAS))]
+        fusion_proc = mp.Process(target=fusion_loop, args=(camera_buffers, landmark_buffer, stop_event))
+    else:
+        camera_buffers = []
+        camera_procs = [mp.Process(target=camera_loop, args=(landmark_buffer, stop_event, moving_flag, motion_end, frame_bus,
+                                                             None, governor_state))]
+        fusion_proc = None
+    model_proc = mp.Process(target=model_worker, args=(landmark_buffer, result_queue, stop_event, model_ready_event, moving_flag,
+                                                       governor_state))
+    robot_proc = mp.Process(target=robot_loop, args=(result_queue, stop_event, robot_online_event, moving_flag, motion_end))
+
+    for camera_proc in camera_procs:
+        camera_proc.start()
+    if fusion_proc is not None:
+        fusion_proc.start()
     model_proc.start()
     robot_proc.start()
 
+    # start latency governor and frame consumers
+    support_procs = []
+    if governor_state is not None:
+        support_procs.append(mp.Process(target=governor_loop, args=(governor_state, stop_event)))
+    if constants.FRAME_PREVIEW:
+        support_procs.append(mp.Process(target=preview_loop, args=(frame_bus, stop_event)))
+    if constants.RECORDING:
+        support_procs.append(mp.Process(target=recorder_loop, args=(frame_bus, stop_event)))
+    for support_proc in support_procs:
+        support_proc.start()
+
     # log information of system readiness
     logger.info("Waiting for model to become ready...")
-    if model_ready_event.wait(timeout=10):
+    if model_ready_event.wait(timeout=constants.MODEL_READY_TIMEOUT):
         logger.info("System is ready")
     else:
         logger.warning("Timeout waiting for system readiness")
 
     robot_proc.join()
     model_proc.join()
-    camera_proc.join()
\ No newline at end of file
+    for camera_proc in camera_procs:
+        camera_proc.join()
+    if fusion_proc is not None:
+        fusion_proc.join()
+    for support_proc in support_procs:
+        support_proc.join()
+    landmark_buffer.close()
+    for camera_buffer in camera_buffers:
+        camera_buffer.close()
+    if frame_bus is not None:
+        frame_bus.close()
\ No newline at end of file
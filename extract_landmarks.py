@@ -0,0 +1,123 @@
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import cv2 as cv
+from settings import constants
+from frame_source import ReplaySource
+from handtracker import HandTracker
+from preprocessing import load_normalisation_vectors, normalise_hand_poses
+
+
+logger = logging.getLogger("extraction")
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".npy")
+
+# hand tracker and normalisation vectors of a worker process, created once by init_worker
+_hand_tracker = None
+_min_vector = None
+_max_vector = None
+
+def init_worker() -> None:
+    """
+    Create the hand tracker of a worker process, recordings are extracted for a single operator.
+    """
+    global _hand_tracker, _min_vector, _max_vector
+    _hand_tracker = HandTracker(num_operators=1)
+    _min_vector, _max_vector = load_normalisation_vectors()
+
+def find_videos(input_dir: str, output_dir: str, extensions: tuple) -> list:
+    """
+    Find recordings and the path of their landmark archives, mirroring the input directory.
+
+    :param input_dir: directory with the recordings
+    :param output_dir: directory of the landmark archives
+    :param extensions: file extensions of the recordings
+    :return: sorted list of tuples (recording path, archive path)
+    """
+    videos = []
+    for root, _, files in os.walk(input_dir):
+        for file in files:
+            if file.lower().endswith(extensions):
+                video_path = os.path.join(root, file)
+                relative_path = os.path.relpath(video_path, input_dir)
+                videos.append((video_path, os.path.join(output_dir, os.path.splitext(relative_path)[0] + ".npy")))
+    return sorted(videos)
+
+def extract_video(task: tuple) -> tuple:
+    """
+    Track hands in every step-th frame of a recording and save the normalised landmarks.
+
+    :param task: tuple (recording path, archive path, step)
+    :return: tuple (recording path, number of frames or None if extraction failed, duration [s])
+    """
+    video_path, output_path, step = task
+    start = time.perf_counter()
+
+    # every recording starts without previous hands
+    _hand_tracker.reset()
+    source = ReplaySource(video_path, realtime=False)
+    hand_poses = []
+    try:
+        source.start()
+        while True:
+            try:
+                bgr_frame, _, sequence = source.read()
+            except EOFError:
+                break
+            if sequence % step == 0:
+                hand_poses.append(_hand_tracker.get_hand_poses_from_frame(cv.cvtColor(bgr_frame, cv.COLOR_BGR2RGB)))
+    except Exception:
+        logger.exception(f"Extraction of {video_path} failed")
+        return video_path, None, time.perf_counter() - start
+    finally:
+        source.stop()
+
+    hand_poses = np.array(hand_poses, dtype=np.float32).reshape((-1, 3, 42))
+    hand_poses = normalise_hand_poses(hand_poses, _min_vector, _max_vector).astype(np.float32)
+
+    # write to a temporary file first, so an interrupted run never leaves a partial archive behind
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temporary_path = output_path + ".tmp.npy"
+    np.save(temporary_path, hand_poses)
+    os.replace(temporary_path, output_path)
+
+    return video_path, len(hand_poses), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract normalised hand landmarks [frames, 3, 42] from recorded videos")
+    parser.add_argument("input_dir", help="directory with video files or .npy stacks of BGR frames")
+    parser.add_argument("output_dir", help="directory of the landmark archives, mirrors the input directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--step", type=int, default=constants.SKIP_FRAMES + 1,
+                        help="keep one frame every step frames (SKIP_FRAMES + 1)")
+    parser.add_argument("--extensions", nargs="+", default=VIDEO_EXTENSIONS, help="file extensions of the recordings")
+    parser.add_argument("--overwrite", action="store_true", help="extract recordings that already have an archive")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    # recordings with an archive were extracted by a previous run
+    videos = find_videos(args.input_dir, args.output_dir, tuple(ext.lower() for ext in args.extensions))
+    tasks = [(video_path, output_path, args.step) for video_path, output_path in videos
+             if args.overwrite or not os.path.exists(output_path)]
+    logger.info(f"{len(videos)} recordings found, {len(videos) - len(tasks)} already extracted")
+    if not tasks:
+        return
+
+    # one recording per task, so a worker tracks the frames of a recording in order
+    start = time.perf_counter()
+    failed = 0
+    with mp.Pool(min(args.workers, len(tasks)), initializer=init_worker) as pool:
+        for done, (video_path, frames, duration) in enumerate(pool.imap_unordered(extract_video, tasks), start=1):
+            if frames is None:
+                failed += 1
+                continue
+            logger.info(f"[{done}/{len(tasks)}] {video_path}: {frames} frames in {duration:.1f} s")
+
+    logger.info(f"Extracted {len(tasks) - failed} recordings in {time.perf_counter() - start:.1f} s, {failed} failed")
+
+if __name__ == "__main__":
+    main()
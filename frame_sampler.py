@@ -0,0 +1,140 @@
+import numpy as np
+from settings import constants
+
+
+def get_visible_hands(hand_poses: np.array) -> np.array:
+    """
+    Find which hands were detected, hands not yet detected are represented as zeros.
+
+    :param hand_poses: landmarks with shape [..., 3, 42]
+    :return: boolean array with shape [..., 2], True for detected hands
+    """
+    hands = hand_poses.reshape(hand_poses.shape[:-1] + (2, 21))
+    return np.abs(hands).sum(axis=(-3, -1)) > 0.001
+
+# fixed subsampling of the camera frames, one frame every SKIP_FRAMES + 1
+class FixedSampler:
+    def __init__(self, skip_frames: int = constants.SKIP_FRAMES):
+        self.skip_frames = skip_frames
+
+    def set_min_skip(self, skip_frames: int) -> None:
+        """
+        Change the number of skipped frames, e.g. to lower the sample rate under load.
+
+        :param skip_frames: frames skipped after each tracked frame
+        """
+        self.skip_frames = skip_frames
+
+    def next_sequence(self, last_sequence: int) -> int:
+        """
+        Get the sequence number of the next frame to track.
+
+        :param last_sequence: sequence number of the last tracked frame
+        :return: lowest sequence number of the next frame to track
+        """
+        return last_sequence + self.skip_frames + 1
+
+    def update(self, hand_poses: np.array, timestamp: float) -> None:
+        """
+        Update the sampler with the landmarks of the last tracked frame.
+
+        :param hand_poses: landmarks of the frame
+        :param timestamp: capture timestamp of the frame [s]
+        """
+        pass
+
+# subsampling that tracks more frames while the hands move fast and fewer while they are static
+class AdaptiveSampler(FixedSampler):
+    def __init__(self, min_skip: int = constants.SAMPLER_MIN_SKIP, max_skip: int = constants.SAMPLER_MAX_SKIP,
+                 low_velocity: float = constants.SAMPLER_LOW_VELOCITY, high_velocity: float = constants.SAMPLER_HIGH_VELOCITY):
+        super().__init__(min_skip)
+        self._min_skip = min_skip
+        self._max_skip = max_skip
+        self._low_velocity = low_velocity
+        self._high_velocity = high_velocity
+
+        # landmarks and timestamp of the last tracked frame
+        self._last_poses = None
+        self._last_timestamp = None
+        self.velocity = 0.0
+
+    def set_min_skip(self, skip_frames: int) -> None:
+        # fast hands skip at least the given frames
+        self._min_skip = min(skip_frames, self._max_skip)
+        self.skip_frames = max(self.skip_frames, self._min_skip)
+
+    def update(self, hand_poses: np.array, timestamp: float) -> None:
+        if self._last_poses is not None and timestamp > self._last_timestamp:
+            # mean landmark speed of the hands detected in both frames [normalised units / s]
+            visible = get_visible_hands(hand_poses) & get_visible_hands(self._last_poses)
+            if visible.any():
+                displacement = np.abs(hand_poses - self._last_poses).reshape(hand_poses.shape[:-1] + (2, 21))
+                self.velocity = displacement.mean(axis=(-3, -1))[visible].mean() / (timestamp - self._last_timestamp)
+
+            # map velocity between the thresholds to the skipped frames, fast hands skip min_skip frames
+            ratio = np.clip((self.velocity - self._low_velocity) / (self._high_velocity - self._low_velocity), 0, 1)
+            skip_frames = int(round(self._max_skip - ratio * (self._max_skip - self._min_skip)))
+
+            # speed up at once but slow down one frame at a time, keeping resolution through movement-to-static transitions
+            self.skip_frames = min(skip_frames, self.skip_frames + 1)
+
+        self._last_poses = hand_poses.copy()
+        self._last_timestamp = timestamp
+
+def get_frame_sampler() -> FixedSampler:
+    """
+    Create the frame sampler selected in the settings.
+
+    :return: adaptive sampler if ADAPTIVE_SAMPLING is set, fixed sampler otherwise
+    """
+    if constants.ADAPTIVE_SAMPLING:
+        return AdaptiveSampler()
+    return FixedSampler()
+
+# resamples landmarks received at varying times to a fixed period by linear interpolation
+class TemporalResampler:
+    def __init__(self, period: float, max_gap: float = constants.RESAMPLER_MAX_GAP):
+        self._period = period
+        self._max_gap = max_gap
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget the previous landmarks, the next landmarks start a new grid.
+        """
+        self._last_frame = None
+        self._last_timestamp = None
+        self._next_timestamp = None
+
+    def add(self, frame: np.array, timestamp: float) -> list:
+        """
+        Add landmarks and get the landmarks of every grid time reached.
+
+        :param frame: landmarks, not modified or kept
+        :param timestamp: capture timestamp of the landmarks [s]
+        :return: list of landmarks at the grid times up to the given timestamp
+        """
+        # start a new grid on the first landmarks or after a long gap (e.g. camera stalled)
+        if self._last_frame is None or timestamp - self._last_timestamp > self._max_gap:
+            self._last_frame = frame.copy()
+            self._last_timestamp = timestamp
+            self._next_timestamp = timestamp + self._period
+            return [self._last_frame.copy()]
+
+        if timestamp <= self._last_timestamp:
+            return []
+
+        # hands missing in one of the samples are not interpolated, the nearest sample is used
+        visible = get_visible_hands(frame) & get_visible_hands(self._last_frame)
+        visible = np.repeat(visible, 21, axis=-1)[..., np.newaxis, :]
+
+        frames = []
+        while self._next_timestamp <= timestamp:
+            weight = (self._next_timestamp - self._last_timestamp) / (timestamp - self._last_timestamp)
+            nearest = self._last_frame if weight < 0.5 else frame
+            frames.append(np.where(visible, self._last_frame + weight * (frame - self._last_frame), nearest))
+            self._next_timestamp += self._period
+
+        self._last_frame = frame.copy()
+        self._last_timestamp = timestamp
+        return frames
@@ -0,0 +1,193 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import time
+import logging
+import os
+import cv2 as cv
+from settings import constants
+
+
+logger = logging.getLogger("camera")
+
+# interface of the sources of BGR frames read by the camera process
+class FrameSource(ABC):
+    # True if every frame must reach the tracking stage, False if older frames may be dropped
+    lossless = False
+
+    # shape of the frames, known once the source is started
+    frame_shape = None
+
+    @abstractmethod
+    def start(self) -> None:
+        """
+        Start streaming frames.
+        """
+
+    @abstractmethod
+    def read(self):
+        """
+        Get the next frame, raises EOFError when the source has no more frames.
+
+        :return: tuple (BGR frame, capture timestamp [s], sequence number) or None if no frame arrived
+        """
+
+    @abstractmethod
+    def stop(self) -> None:
+        """
+        Stop streaming frames and release the source.
+        """
+
+# live frames from an Intel RealSense camera
+class RealSenseSource(FrameSource):
+    lossless = False
+
+    def __init__(self, serial: str = None, global_time: bool = False):
+        # librealsense is only imported for live cameras, replays run without it
+        import pyrealsense2 as rs
+        self._rs = rs
+
+        # initialize pipeline and config, a serial number selects the camera if several are connected
+        self._pipeline = rs.pipeline()
+        self._config = rs.config()
+        if serial is not None:
+            self._config.enable_device(serial)
+        self._queue = None
+        self._checked_domain = False
+
+        # Get device product line for setting a supporting resolution
+        pipeline_wrapper = rs.pipeline_wrapper(self._pipeline)
+        pipeline_profile = self._config.resolve(pipeline_wrapper)
+        device = pipeline_profile.get_device()
+
+        # check if camera has the necessary capabilities
+        found_rgb = False
+        for s in device.sensors:
+            if s.get_info(rs.camera_info.name) == 'RGB Camera':
+                found_rgb = True
+                break
+        if not found_rgb:
+            raise IOError("RGB camera not found!")
+
+        # timestamps of several cameras are only comparable in the global time domain (hardware clock mapped to host time)
+        self._global_time = global_time
+        if global_time:
+            for s in device.sensors:
+                if s.supports(rs.option.global_time_enabled):
+                    s.set_option(rs.option.global_time_enabled, 1)
+
+        self._config.enable_stream(rs.stream.color, constants.STREAM_WIDTH, constants.STREAM_HEIGHT, rs.format.bgr8, constants.STREAM_FPS)
+        self.frame_shape = (constants.STREAM_HEIGHT, constants.STREAM_WIDTH, 3)
+
+    def start(self) -> None:
+        # stream into a single-slot queue, older frames are dropped
+        self._queue = self._rs.frame_queue(1, keep_frames=True)
+        self._pipeline.start(self._config, self._queue)
+
+    def read(self):
+        # get newest frame received by the camera
+        received, frames = self._queue.try_wait_for_frame(100)
+        if not received:
+            return None
+        color_frame = frames.as_frameset().get_color_frame()
+        if not color_frame:
+            return None
+
+        # RealSense timestamps are in milliseconds, hardware clock keeps them free of host scheduling jitter
+        if not self._checked_domain:
+            timestamp_domain = self._rs.timestamp_domain
+            domain = timestamp_domain.global_time if self._global_time else timestamp_domain.hardware_clock
+            if color_frame.get_frame_timestamp_domain() != domain:
+                logger.warning(f"Camera timestamps not in {domain} domain "
+                               f"({color_frame.get_frame_timestamp_domain()})")
+            self._checked_domain = True
+
+        return np.asanyarray(color_frame.get_data()), color_frame.get_timestamp() / 1000, color_frame.get_frame_number()
+
+    def stop(self) -> None:
+        if self._queue is not None:
+            self._pipeline.stop()
+            self._queue = None
+
+# recorded frames from a video file or a .npy stack of BGR frames with shape [frames, height, width, 3]
+class ReplaySource(FrameSource):
+    def __init__(self, path: str, realtime: bool = True, fps: float = None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"There is no file {path}")
+
+        self._path = path
+        self._realtime = realtime
+        self._frames = None
+        self._video = None
+        self._index = 0
+        self._start_time = None
+        self.fps = fps
+
+        # when not paced in real time every frame is processed, so runs are reproducible
+        self.lossless = not realtime
+
+    def start(self) -> None:
+        if self._path.endswith(".npy"):
+            self._frames = np.load(self._path, mmap_mode="r")
+            if self._frames.ndim != 4 or self._frames.shape[-1] != 3:
+                raise ValueError(f"Frame stack {self._path} must have shape [frames, height, width, 3]")
+            self.frame_shape = self._frames.shape[1:]
+        else:
+            self._video = cv.VideoCapture(self._path)
+            if not self._video.isOpened():
+                raise IOError(f"Video {self._path} could not be opened")
+            self.frame_shape = (int(self._video.get(cv.CAP_PROP_FRAME_HEIGHT)), int(self._video.get(cv.CAP_PROP_FRAME_WIDTH)), 3)
+            if self.fps is None and self._video.get(cv.CAP_PROP_FPS) > 0:
+                self.fps = self._video.get(cv.CAP_PROP_FPS)
+
+        if self.fps is None:
+            self.fps = constants.STREAM_FPS
+
+        self._index = 0
+        self._start_time = time.perf_counter()
+        logger.info(f"Replaying {self._path} at {self.fps} FPS ({'real time' if self._realtime else 'as fast as possible'})")
+
+    def read(self):
+        # get next recorded frame
+        if self._frames is not None:
+            if self._index >= len(self._frames):
+                raise EOFError(f"End of {self._path}")
+            frame = np.ascontiguousarray(self._frames[self._index])
+        else:
+            received, frame = self._video.read()
+            if not received:
+                raise EOFError(f"End of {self._path}")
+
+        # timestamps follow the recording rate so replays are deterministic
+        sequence = self._index
+        timestamp = sequence / self.fps
+        self._index += 1
+
+        # wait until the frame would have been captured
+        if self._realtime:
+            delay = self._start_time + timestamp - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        return frame, timestamp, sequence
+
+    def stop(self) -> None:
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+        self._frames = None
+
+def create_frame_source(camera: dict = None) -> FrameSource:
+    """
+    Create the frame source selected in the settings.
+
+    :param camera: entry of CAMERAS in multi-camera mode, None for a single camera
+    :return: replay source if a replay path is set, RealSense source otherwise
+    """
+    if camera is not None:
+        if camera.get("replay"):
+            return ReplaySource(camera["replay"], constants.REPLAY_REALTIME)
+        return RealSenseSource(camera.get("serial"), global_time=True)
+
+    if constants.REPLAY_PATH:
+        return ReplaySource(constants.REPLAY_PATH, constants.REPLAY_REALTIME)
+    return RealSenseSource()
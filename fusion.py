@@ -0,0 +1,162 @@
+import collections
+import logging
+import time
+import numpy as np
+from settings import constants
+from frame_sampler import get_visible_hands
+from landmark_buffer import LandmarkRingBuffer
+
+
+# logger of the fusion process, its file is only opened by the fusion process
+logger = logging.getLogger("fusion")
+
+# merges the landmarks of several cameras aligned by capture timestamp, averaging the cameras that detected each hand
+class LandmarkFusion:
+    def __init__(self, num_cameras: int, max_offset: float = constants.FUSION_MAX_OFFSET, history: int = 8):
+        self._max_offset = max_offset
+
+        # recent samples (timestamp, flags, landmarks, confidence) of each camera
+        self._samples = [collections.deque(maxlen=history) for _ in range(num_cameras)]
+
+    def add(self, camera: int, timestamp: float, flags: int, landmarks: np.array, confidence: np.array) -> None:
+        """
+        Store a sample of a camera.
+
+        :param camera: camera index, 0 for the reference camera
+        :param timestamp: capture timestamp [s]
+        :param flags: slot flags of the sample
+        :param landmarks: normalised landmarks with shape [3, 42], kept (not a view into shared memory)
+        :param confidence: confidence of the left and right hands, kept
+        """
+        self._samples[camera].append((timestamp, flags, landmarks, confidence))
+
+    def is_aligned(self, camera: int, timestamp: float) -> bool:
+        """
+        Check if a camera has a sample to fuse with a reference sample, i.e. a sample within the maximum offset
+        or a sample captured after the reference sample (later samples will be farther away).
+
+        :param camera: camera index
+        :param timestamp: capture timestamp of the reference sample [s]
+        :return: True if waiting for more samples of the camera cannot improve the alignment
+        """
+        samples = self._samples[camera]
+        return len(samples) > 0 and samples[-1][0] >= timestamp - self._max_offset
+
+    def fuse(self, timestamp: float, flags: int, landmarks: np.array, confidence: np.array) -> tuple:
+        """
+        Fuse a reference sample with the closest sample of every other camera.
+
+        :param timestamp: capture timestamp of the reference sample [s]
+        :param flags: slot flags of the reference sample
+        :param landmarks: normalised landmarks of the reference sample [3, 42]
+        :param confidence: confidence of the left and right hands of the reference sample
+        :return: tuple (fused landmarks [3, 42], highest confidence of each hand over the fused cameras, number of cameras fused)
+        """
+        hands = [landmarks.reshape((3, 2, 21))]
+        confidences = [confidence]
+        for samples in self._samples[1:]:
+            if not samples:
+                continue
+            sample_timestamp, _, sample_landmarks, sample_confidence = min(samples, key=lambda sample: abs(sample[0] - timestamp))
+            if abs(sample_timestamp - timestamp) <= self._max_offset:
+                hands.append(sample_landmarks.reshape((3, 2, 21)))
+                confidences.append(sample_confidence)
+
+        # hands [cameras, 3, 2, 21] averaged over the cameras that detected them in this sample [cameras, 2], the handedness
+        # confidence is not a weight (at least 0.5 for every detection), it is only zero for hands kept from a previous frame;
+        # hands not detected by any camera keep the reference landmarks
+        hands = np.stack(hands)
+        confidences = np.stack(confidences)
+        weights = (confidences > 0) * get_visible_hands(hands.reshape((-1, 3, 42)))
+        total = weights.sum(axis=0)
+        fused = (hands * weights[:, np.newaxis, :, np.newaxis]).sum(axis=0) / np.maximum(total, 1e-6)[np.newaxis, :, np.newaxis]
+        fused = np.where((total > 0)[np.newaxis, :, np.newaxis], fused, hands[0])
+
+        return fused.reshape((3, 42)).astype(np.float32), confidences.max(axis=0), len(hands)
+
+def read_samples(landmark_buffer: LandmarkRingBuffer, camera: int, fusion: LandmarkFusion) -> None:
+    """
+    Move every unread sample of a camera buffer into the fusion history.
+
+    :param landmark_buffer: ring buffer of the camera
+    :param camera: camera index
+    :param fusion: fusion stage
+    """
+    while True:
+        entry = landmark_buffer.read()
+        if entry is None:
+            return
+        sequence, timestamp, flags, landmarks, confidence = entry
+        landmarks, confidence = landmarks.copy(), confidence.copy()
+
+        # discard landmarks if the camera overwrote the slot while they were copied
+        if landmark_buffer.is_valid(sequence):
+            fusion.add(camera, timestamp, flags, landmarks, confidence)
+
+def fusion_loop(camera_buffers: list, landmark_buffer: LandmarkRingBuffer, stop_event):
+    """
+    Fusion process, merges the landmarks of every camera into the landmark buffer read by the model process.
+    Landmarks are published at the rate of the reference camera (the first one).
+
+    :param camera_buffers: ring buffers written by the camera processes, the first one is the reference camera
+    :param landmark_buffer: ring buffer read by the model process
+    :param stop_event: event to stop the process
+    """
+    # define logging file for the fusion process
+    logging.basicConfig(level=logging.DEBUG if constants.DEBUG else logging.INFO, format='[%(asctime)s] [%(name)s] %(message)s')
+    file_handler = logging.FileHandler("fusion.log")
+    formatter = logging.Formatter('[%(asctime)s] [%(name)s] %(message)s')
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+    fusion = LandmarkFusion(len(camera_buffers))
+    reference_buffer = camera_buffers[0]
+
+    # reference samples waiting for the other cameras, with the time they were received
+    pending = collections.deque()
+
+    last_heartbeat = time.time()
+    fused_frames = 0
+    fused_cameras = 0
+
+    logger.info(f"Fusing landmarks of {len(camera_buffers)} cameras")
+    try:
+        while not stop_event.is_set():
+            # wait for the reference camera, or briefly for the other cameras while samples are pending
+            if reference_buffer.wait(timeout=0.001 if pending else 0.1):
+                while True:
+                    entry = reference_buffer.read()
+                    if entry is None:
+                        break
+                    sequence, timestamp, flags, landmarks, confidence = entry
+                    landmarks, confidence = landmarks.copy(), confidence.copy()
+                    if reference_buffer.is_valid(sequence):
+                        pending.append((time.perf_counter(), timestamp, flags, landmarks, confidence))
+
+            for camera, camera_buffer in enumerate(camera_buffers[1:], start=1):
+                read_samples(camera_buffer, camera, fusion)
+
+            # fuse in order, once every camera is aligned or the sample waited too long (camera stalled or lagging)
+            while pending:
+                received, timestamp, flags, landmarks, confidence = pending[0]
+                if not all(fusion.is_aligned(camera, timestamp) for camera in range(1, len(camera_buffers))) and \
+                        time.perf_counter() - received < constants.FUSION_MAX_WAIT:
+                    break
+                pending.popleft()
+
+                fused, fused_confidence, cameras = fusion.fuse(timestamp, flags, landmarks, confidence)
+                landmark_buffer.write(fused, timestamp, flags, fused_confidence)
+                fused_frames += 1
+                fused_cameras += cameras
+
+            if time.time() - last_heartbeat > 5:
+                logger.info(f"Fusion running... fused {fused_frames} frames, {fused_cameras / max(fused_frames, 1):.2f} "
+                            f"cameras per frame, lost {sum(camera_buffer.lost for camera_buffer in camera_buffers)} camera frames")
+                last_heartbeat = time.time()
+                fused_frames = 0
+                fused_cameras = 0
+
+    except Exception:
+        logger.error("Fusion error", exc_info=True)
+    finally:
+        logger.info("Fusion stopped")
@@ -0,0 +1,102 @@
+import multiprocessing as mp
+import logging
+import time
+from settings import constants
+
+
+# logger of the governor process, its file is only opened by the governor process
+# (the camera and model processes import this module even without a governor)
+logger = logging.getLogger("governor")
+
+def get_degradation_setting(level: int, name: str, default):
+    """
+    Get a setting of a degradation level.
+
+    :param level: degradation level, index of DEGRADATION_LEVELS
+    :param name: setting name, e.g. skip_frames, model_complexity, segmentation_models or classification_models
+    :param default: value used when the level does not change the setting
+    :return: value of the setting at the given level
+    """
+    return constants.DEGRADATION_LEVELS[level].get(name, default)
+
+# state shared between the governor and the pipeline stages
+class GovernorState:
+    # stages whose latency is measured, each camera has its own stage from CAMERA_STAGE on
+    MODEL_STAGE = 0
+    CAMERA_STAGE = 1
+
+    def __init__(self, num_cameras: int = 1):
+        # current degradation level and smoothed latency of each stage [s]
+        self.level = mp.Value("i", 0)
+        self.latency = mp.Array("d", 1 + num_cameras)
+
+# exponential moving average of the latency of a stage, published to the governor
+class StageLatency:
+    def __init__(self, governor_state: GovernorState, stage: int, smoothing: float = 0.1):
+        self._governor_state = governor_state
+        self._stage = stage
+        self._smoothing = smoothing
+        self._latency = None
+
+    def add(self, latency: float) -> None:
+        """
+        Add the latency of a frame.
+
+        :param latency: latency of the stage for one frame [s]
+        """
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += self._smoothing * (latency - self._latency)
+        self._governor_state.latency[self._stage] = self._latency
+
+def governor_loop(governor_state: GovernorState, stop_event):
+    """
+    Governor process, steps through the degradation levels to keep the end-to-end latency within LATENCY_BUDGET.
+    The level rises while the latency exceeds the budget and falls once it is below GOVERNOR_RECOVERY of the budget,
+    at most one step every GOVERNOR_INTERVAL seconds.
+
+    :param governor_state: state shared with the camera and model processes
+    :param stop_event: event to stop the process
+    """
+    # define logging file for the governor process
+    logging.basicConfig(level=logging.DEBUG if constants.DEBUG else logging.INFO, format='[%(asctime)s] [%(name)s] %(message)s')
+    file_handler = logging.FileHandler("governor.log")
+    formatter = logging.Formatter('[%(asctime)s] [%(name)s] %(message)s')
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+    last_change = time.time()
+    max_level = len(constants.DEGRADATION_LEVELS) - 1
+    logger.info(f"Governor started, latency budget {1000 * constants.LATENCY_BUDGET:.0f} ms, {max_level + 1} levels")
+
+    try:
+        while not stop_event.is_set():
+            time.sleep(0.1)
+            if time.time() - last_change < constants.GOVERNOR_INTERVAL:
+                continue
+
+            # cameras run in parallel, the slowest one limits the latency
+            camera_latency = max(governor_state.latency[GovernorState.CAMERA_STAGE:])
+            model_latency = governor_state.latency[GovernorState.MODEL_STAGE]
+            latency = camera_latency + model_latency
+            level = governor_state.level.value
+
+            # degrade while over budget, recover with a margin so levels do not oscillate
+            if latency > constants.LATENCY_BUDGET and level < max_level:
+                new_level = level + 1
+            elif latency < constants.GOVERNOR_RECOVERY * constants.LATENCY_BUDGET and level > 0:
+                new_level = level - 1
+            else:
+                continue
+
+            governor_state.level.value = new_level
+            last_change = time.time()
+            logger.info(f"Degradation level {level} -> {new_level} {constants.DEGRADATION_LEVELS[new_level]}, "
+                        f"latency {1000 * latency:.0f} ms (camera {1000 * camera_latency:.0f} ms, "
+                        f"model {1000 * model_latency:.0f} ms), budget {1000 * constants.LATENCY_BUDGET:.0f} ms")
+
+    except Exception:
+        logger.error("Governor error", exc_info=True)
+    finally:
+        logger.info("Governor stopped")
@@ -0,0 +1,370 @@
+import math
+import numpy as np
+import cv2 as cv
+import mediapipe as mp
+from settings import constants
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+
+# interface of the hand landmark detectors used by HandTracker
+class HandBackend:
+    # True if the backend follows hands between consecutive frames itself, region-of-interest cropping is then not used
+    tracks_hands = False
+
+    # landmark model complexity, None if the backend has a single model
+    model_complexity = None
+
+    def process(self, rgb_frame: np.array) -> tuple:
+        """
+        Detect the hands of a frame.
+
+        :param rgb_frame: RGB frame
+        :return: tuple (hand vectors [hands, 3, 21] with normalised coordinates, confidence of each hand [hands])
+        """
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        """
+        Forget the hands of previous frames, the next frame runs the palm detector.
+        """
+        pass
+
+    def set_model_complexity(self, model_complexity: int) -> None:
+        """
+        Change the landmark model complexity, lower is faster.
+
+        :param model_complexity: 0 (lite) or 1 (full)
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Release the resources of the backend.
+        """
+        pass
+
+# MediaPipe hands solution
+class MediaPipeBackend(HandBackend):
+    def __init__(self, mode: str = constants.HAND_TRACKING_MODE, model_complexity: int = constants.MODEL_COMPLEXITY,
+                 max_hands: int = 2):
+        # in video mode the palm detector only runs when tracking is lost
+        self._mode = mode
+        self.tracks_hands = mode == "video"
+        self._hand_tracker = None
+        self._max_hands = max_hands
+
+        # frames tracked since the last palm detection was forced and hands tracked in the previous frame
+        self._frames_since_detection = 0
+        self._tracked_hands = 0
+        self.set_model_complexity(model_complexity)
+
+    def set_model_complexity(self, model_complexity: int) -> None:
+        if model_complexity == self.model_complexity:
+            return
+        self.close()
+        self.model_complexity = model_complexity
+        self._hand_tracker = mp.solutions.hands.Hands(max_num_hands=self._max_hands, model_complexity=model_complexity,
+                                                      min_detection_confidence=constants.MIN_DETECTION_CONFIDENCE,
+                                                      min_tracking_confidence=constants.MIN_TRACKING_CONFIDENCE,
+                                                      static_image_mode=self._mode == "image")
+        self._frames_since_detection = 0
+        self._tracked_hands = 0
+
+    def reset(self) -> None:
+        if self._mode == "video":
+            self._hand_tracker.reset()
+            self._frames_since_detection = 0
+            self._tracked_hands = 0
+
+    def process(self, rgb_frame: np.array) -> tuple:
+        rgb_frame.flags.writeable = False
+        hand_pose = self._hand_tracker.process(rgb_frame)
+        rgb_frame.flags.writeable = True
+
+        # in video mode force a new palm detection when a tracked hand is lost (its landmark presence fell below
+        # MIN_TRACKING_CONFIDENCE) or after REDETECTION_INTERVAL frames, the remaining hands are detected again
+        # (the handedness score is at least 0.5 by construction and does not measure the tracking quality)
+        num_hands = len(hand_pose.multi_hand_landmarks) if hand_pose.multi_hand_landmarks else 0
+        if self._mode == "video":
+            self._frames_since_detection += 1
+            if num_hands < self._tracked_hands or 0 < constants.REDETECTION_INTERVAL <= self._frames_since_detection:
+                self._hand_tracker.reset()
+                self._frames_since_detection = 0
+            self._tracked_hands = num_hands
+
+        if num_hands == 0:
+            return np.zeros((0, 3, 21), dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+        # handedness scores, used as the detection confidence of each hand
+        scores = np.array([handedness.classification[0].score for handedness in hand_pose.multi_handedness], dtype=np.float32)
+
+        hands = np.array([[(landmark.x, landmark.y, landmark.z) for landmark in hand.landmark]
+                          for hand in hand_pose.multi_hand_landmarks], dtype=np.float32)
+        return hands.transpose(0, 2, 1), scores
+
+    def close(self) -> None:
+        if self._hand_tracker is not None:
+            self._hand_tracker.close()
+            self._hand_tracker = None
+
+def get_palm_anchors(input_size: int = 192, strides: tuple = (8, 16, 16, 16)) -> np.array:
+    """
+    SSD anchors of the MediaPipe palm detection model, fixed size and two anchors per layer and cell.
+
+    :param input_size: size of the square model input
+    :param strides: stride of each layer
+    :return: anchor centres [anchors, 2] in normalised input coordinates
+    """
+    anchors = []
+    layer = 0
+    while layer < len(strides):
+        # consecutive layers with the same stride share the feature map
+        last_layer = layer
+        while last_layer < len(strides) and strides[last_layer] == strides[layer]:
+            last_layer += 1
+        anchors_per_cell = 2 * (last_layer - layer)
+
+        size = math.ceil(input_size / strides[layer])
+        y, x = np.meshgrid((np.arange(size) + 0.5) / size, (np.arange(size) + 0.5) / size, indexing="ij")
+        centres = np.stack((x.ravel(), y.ravel()), axis=1)
+        anchors.append(np.repeat(centres, anchors_per_cell, axis=0))
+        layer = last_layer
+    return np.concatenate(anchors).astype(np.float32)
+
+def get_square_iou(centre: np.array, size: float, other_centre: np.array, other_size: float) -> float:
+    """
+    Intersection over union of two axis-aligned squares.
+
+    :param centre: centre of the first square
+    :param size: side length of the first square
+    :param other_centre: centre of the second square
+    :param other_size: side length of the second square
+    :return: intersection over union
+    """
+    overlap = np.clip(np.minimum(centre + size / 2, other_centre + other_size / 2) -
+                      np.maximum(centre - size / 2, other_centre - other_size / 2), 0, None)
+    intersection = overlap[0] * overlap[1]
+    return intersection / (size ** 2 + other_size ** 2 - intersection)
+
+# exported MediaPipe palm detection and hand landmark models run with ONNX Runtime on the CPU
+class OnnxBackend(HandBackend):
+    # square input size of the landmark model and scale of the palm box into the hand region
+    _LANDMARK_SIZE = 224
+    _PALM_SCALE = 2.6
+    _PALM_SHIFT = -0.5
+    _HAND_SCALE = 2.0
+    _HAND_SHIFT = -0.1
+
+    def __init__(self, mode: str = constants.HAND_TRACKING_MODE, palm_model: str = constants.ONNX_PALM_MODEL,
+                 landmark_model: str = constants.ONNX_LANDMARK_MODEL, threads: int = constants.ONNX_THREADS,
+                 max_hands: int = 2):
+        if ort is None:
+            raise ImportError("The onnx hand backend requires onnxruntime (pip install onnxruntime)")
+
+        # explicit thread counts, a single inter-op thread since the graphs are sequential
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        self._palm_session = ort.InferenceSession(palm_model, options, providers=["CPUExecutionProvider"])
+        self._landmark_session = ort.InferenceSession(landmark_model, options, providers=["CPUExecutionProvider"])
+
+        # input layouts (NHWC as exported from TFLite or NCHW) and whether the landmark model has a dynamic batch size
+        self._palm_input = self._palm_session.get_inputs()[0]
+        self._landmark_input = self._landmark_session.get_inputs()[0]
+        self._palm_nchw = self._palm_input.shape[1] == 3
+        self._landmark_nchw = self._landmark_input.shape[1] == 3
+        self._palm_size = self._palm_input.shape[2]
+        self._landmark_batching = not isinstance(self._landmark_input.shape[0], int)
+        self._anchors = get_palm_anchors(self._palm_size)
+
+        # palm outputs are identified by their last dimension (18 box values or 1 score)
+        palm_outputs = self._palm_session.get_outputs()
+        self._palm_outputs = [next(output.name for output in palm_outputs if output.shape[-1] == 18),
+                              next(output.name for output in palm_outputs if output.shape[-1] == 1)]
+
+        # preallocated model inputs
+        self._palm_frame = np.zeros((self._palm_size, self._palm_size, 3), dtype=np.uint8)
+        self._max_hands = max_hands
+        self._crops = np.zeros((max_hands, self._LANDMARK_SIZE, self._LANDMARK_SIZE, 3), dtype=np.uint8)
+
+        # in video mode hand regions are derived from the landmarks of the previous frame
+        self.tracks_hands = mode == "video"
+        self._regions = []
+        self._frames_since_detection = 0
+
+    def reset(self) -> None:
+        self._regions = []
+        self._frames_since_detection = 0
+
+    def process(self, rgb_frame: np.array) -> tuple:
+        height, width = rgb_frame.shape[:2]
+
+        # palm detection when fewer than the maximum number of hands are tracked or every REDETECTION_INTERVAL frames
+        self._frames_since_detection += 1
+        if len(self._regions) < self._max_hands or not self.tracks_hands or \
+                0 < constants.REDETECTION_INTERVAL <= self._frames_since_detection:
+            self._regions = self._detect_palms(rgb_frame)
+            self._frames_since_detection = 0
+        if not self._regions:
+            return np.zeros((0, 3, 21), dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+        # landmarks of every hand region, in a single batch
+        transforms = [self._crop_region(rgb_frame, region, i) for i, region in enumerate(self._regions)]
+        landmarks, presence = self._run_landmarks(len(self._regions))
+
+        hands = []
+        scores = []
+        regions = []
+        for i, transform in enumerate(transforms):
+            if presence[i] < constants.MIN_TRACKING_CONFIDENCE:
+                continue
+
+            # map crop pixels back to the frame, z is scaled like x
+            points = landmarks[i].reshape((21, 3))
+            xy = cv.transform(points[np.newaxis, :, :2], transform)[0]
+            z = points[:, 2] * self._regions[i][2] / self._LANDMARK_SIZE
+            hands.append(np.stack((xy[:, 0] / width, xy[:, 1] / height, z / width)))
+            scores.append(presence[i])
+            regions.append(self._get_hand_region(xy))
+
+        self._regions = regions
+        if not hands:
+            return np.zeros((0, 3, 21), dtype=np.float32), np.zeros(0, dtype=np.float32)
+        return np.array(hands, dtype=np.float32), np.array(scores, dtype=np.float32)
+
+    def _detect_palms(self, rgb_frame: np.array) -> list:
+        """
+        Run the palm detector on the letterboxed frame.
+
+        :param rgb_frame: RGB frame
+        :return: list of at most max_hands hand regions (centre x, centre y, size, rotation) in frame pixels
+        """
+        height, width = rgb_frame.shape[:2]
+        scale = self._palm_size / max(height, width)
+        resized_width, resized_height = round(width * scale), round(height * scale)
+        pad_x, pad_y = (self._palm_size - resized_width) // 2, (self._palm_size - resized_height) // 2
+        self._palm_frame[:] = 0
+        cv.resize(rgb_frame, (resized_width, resized_height),
+                  dst=self._palm_frame[pad_y:pad_y + resized_height, pad_x:pad_x + resized_width], interpolation=cv.INTER_AREA)
+
+        palm_input = self._palm_frame.astype(np.float32)[np.newaxis] / 255
+        if self._palm_nchw:
+            palm_input = palm_input.transpose(0, 3, 1, 2)
+        boxes, scores = self._palm_session.run(self._palm_outputs, {self._palm_input.name: palm_input})
+        boxes = boxes.reshape((-1, 18))
+        scores = 1 / (1 + np.exp(-np.clip(scores.reshape(-1), -100, 100)))
+
+        # decode boxes and keypoints relative to the anchors, into frame pixels
+        candidates = np.flatnonzero(scores >= constants.MIN_DETECTION_CONFIDENCE)
+        candidates = candidates[np.argsort(-scores[candidates])]
+        boxes = boxes[candidates] / self._palm_size
+        centres = boxes[:, :2] + self._anchors[candidates]
+        keypoints = boxes[:, 4:].reshape((-1, 7, 2)) + self._anchors[candidates, np.newaxis]
+        to_frame = lambda points: (points * self._palm_size - (pad_x, pad_y)) / scale
+        centres, keypoints, sizes = to_frame(centres), to_frame(keypoints), boxes[:, 2:4].max(axis=1) * self._palm_size / scale
+
+        # non-maximum suppression of the square palm boxes, palms are kept from the highest score
+        regions = []
+        kept = []
+        for centre, keypoint, size in zip(centres, keypoints, sizes):
+            if any(get_square_iou(centre, size, other, other_size) > 0.3 for other, other_size in kept):
+                continue
+            kept.append((centre, size))
+
+            # rotation from the wrist (keypoint 0) to the middle finger (keypoint 2), hand region shifted towards the fingers
+            rotation = math.pi / 2 - math.atan2(-(keypoint[2, 1] - keypoint[0, 1]), keypoint[2, 0] - keypoint[0, 0])
+            regions.append(self._shift_region(centre, size, rotation, self._PALM_SCALE, self._PALM_SHIFT))
+            if len(regions) == self._max_hands:
+                break
+        return regions
+
+    def _get_hand_region(self, points: np.array) -> tuple:
+        """
+        Region of a hand in the next frame, from its landmarks.
+
+        :param points: landmark pixel coordinates [21, 2]
+        :return: hand region (centre x, centre y, size, rotation) in frame pixels
+        """
+        # rotation from the wrist (0) to the middle finger base (9), size from the landmarks in the rotated frame
+        rotation = math.pi / 2 - math.atan2(-(points[9, 1] - points[0, 1]), points[9, 0] - points[0, 0])
+        cos, sin = math.cos(rotation), math.sin(rotation)
+        rotated = points @ np.array([[cos, -sin], [sin, cos]], dtype=np.float32)
+        minimum, maximum = rotated.min(axis=0), rotated.max(axis=0)
+        centre = ((minimum + maximum) / 2) @ np.array([[cos, sin], [-sin, cos]], dtype=np.float32)
+        return self._shift_region(centre, (maximum - minimum).max(), rotation, self._HAND_SCALE, self._HAND_SHIFT)
+
+    @staticmethod
+    def _shift_region(centre: np.array, size: float, rotation: float, scale: float, shift: float) -> tuple:
+        """
+        Scale a square region and shift it along its rotated y axis.
+
+        :param centre: centre in pixels
+        :param size: side length in pixels
+        :param rotation: rotation [rad]
+        :param scale: scale of the side length
+        :param shift: shift along the rotated y axis, relative to the side length
+        :return: region (centre x, centre y, size, rotation)
+        """
+        return (centre[0] - shift * size * math.sin(rotation), centre[1] + shift * size * math.cos(rotation),
+                size * scale, rotation)
+
+    def _crop_region(self, rgb_frame: np.array, region: tuple, index: int) -> np.array:
+        """
+        Warp a rotated hand region into a crop of the landmark input.
+
+        :param rgb_frame: RGB frame
+        :param region: hand region (centre x, centre y, size, rotation)
+        :param index: index of the crop in the batch
+        :return: 2x3 affine transform from crop pixels to frame pixels
+        """
+        centre_x, centre_y, size, rotation = region
+        cos, sin = math.cos(rotation), math.sin(rotation)
+        half = size / 2
+        corners = np.array([[-half, -half], [half, -half], [-half, half]], dtype=np.float32)
+        frame_points = corners @ np.array([[cos, sin], [-sin, cos]], dtype=np.float32) + (centre_x, centre_y)
+        crop_points = np.array([[0, 0], [self._LANDMARK_SIZE, 0], [0, self._LANDMARK_SIZE]], dtype=np.float32)
+
+        cv.warpAffine(rgb_frame, cv.getAffineTransform(frame_points.astype(np.float32), crop_points),
+                      (self._LANDMARK_SIZE, self._LANDMARK_SIZE), dst=self._crops[index], borderMode=cv.BORDER_CONSTANT)
+        return cv.getAffineTransform(crop_points, frame_points.astype(np.float32))
+
+    def _run_landmarks(self, num_crops: int) -> tuple:
+        """
+        Run the landmark model on the first crops, in one call if the model accepts batches.
+
+        :param num_crops: number of crops
+        :return: tuple (landmarks in crop pixels [crops, 63], hand presence [crops])
+        """
+        crops = self._crops[:num_crops].astype(np.float32) / 255
+        if self._landmark_nchw:
+            crops = crops.transpose(0, 3, 1, 2)
+
+        # outputs in the order of the TFLite model: landmarks, hand presence, handedness, world landmarks
+        if self._landmark_batching:
+            outputs = self._landmark_session.run(None, {self._landmark_input.name: crops})
+        else:
+            outputs = [np.concatenate(batch) for batch in
+                       zip(*[self._landmark_session.run(None, {self._landmark_input.name: crops[i:i + 1]}) for i in range(num_crops)])]
+        return outputs[0].reshape((num_crops, 63)), outputs[1].reshape(num_crops)
+
+def create_hand_backend(mode: str = constants.HAND_TRACKING_MODE, model_complexity: int = constants.MODEL_COMPLEXITY,
+                        backend: str = constants.HAND_BACKEND, max_hands: int = 2) -> HandBackend:
+    """
+    Create the hand landmark backend selected in the settings.
+
+    :param mode: hand tracking mode, image or video
+    :param model_complexity: landmark model complexity of the MediaPipe backend
+    :param backend: mediapipe or onnx
+    :param max_hands: maximum number of hands detected in a frame
+    :return: hand backend
+    """
+    if backend == "mediapipe":
+        return MediaPipeBackend(mode, model_complexity, max_hands)
+    if backend == "onnx":
+        return OnnxBackend(mode, max_hands=max_hands)
+    raise ValueError(f"Hand backend {backend} is not valid! Use mediapipe or onnx")
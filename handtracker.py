@@ -1,20 +1,46 @@
 import math
 from settings import constants
-import mediapipe as mp
+from hand_backends import create_hand_backend
+from landmark_buffer import get_landmark_shape
 import numpy as np
+import cv2 as cv
 
 
 # class to get hand-tracking data from frames
 class HandTracker:
-    def __init__(self):
-        # hand tracking object
-        self._hand_tracker = mp.solutions.hands.Hands(max_num_hands=2, model_complexity=1,
-                                                      min_detection_confidence=0.3, min_tracking_confidence=0.3,
-                                                      static_image_mode=True)
-
-        # last hand vectors
-        self._last_left_hand = None
-        self._last_right_hand = None
+    def __init__(self, mode: str = constants.HAND_TRACKING_MODE, roi_tracking: bool = constants.ROI_TRACKING,
+                 inference_scale: float = constants.INFERENCE_SCALE, model_complexity: int = constants.MODEL_COMPLEXITY,
+                 backend: str = constants.HAND_BACKEND, num_operators: int = constants.NUM_OPERATORS):
+        if mode not in ["image", "video"]:
+            raise ValueError(f"Hand tracking mode {mode} is not valid! Use image or video")
+
+        # frames are resized by the inference scale into a preallocated buffer
+        self._inference_scale = inference_scale
+        self._inference_frame = None
+
+        # hand landmark backend detecting the hands of every operator, in video mode the palm detector only runs
+        # when tracking is lost
+        self._mode = mode
+        self._num_operators = num_operators
+        self._backend = create_hand_backend(mode, model_complexity, backend, 2 * num_operators)
+
+        # last left and right hand vectors of each operator [operators, 2, 3, 21] and operators seen since the last reset
+        self._last_hands = None
+        self._operator_seen = None
+
+        # handedness scores of the hands found by the last detection and confidence of the left and right hands,
+        # zero for a hand kept from a previous frame, with shape [2] for a single operator or [operators, 2]
+        self.detection_scores = np.zeros(0, dtype=np.float32)
+        self._confidence = np.zeros((num_operators, 2), dtype=np.float32)
+        self.hand_confidence = self._confidence[0] if num_operators == 1 else self._confidence
+
+        # search hands in a region around the hands of the previous frame
+        # not used if the backend tracks hands itself, changing crops would break the tracking between frames
+        self._roi_tracking = roi_tracking and not self._backend.tracks_hands
+        self._hands_visible = False
+
+        # crops are copied into a preallocated buffer of the frame size, viewed with the shape of each crop
+        self._roi_buffer = None
 
         # reset values for last saved hands
         self.reset()
@@ -23,19 +49,25 @@ class HandTracker:
         """
         Reset last hand tracking values.
         """
-        self._last_left_hand = np.zeros((3, 21))
-        self._last_right_hand = np.zeros((3, 21))
+        self._last_hands = np.zeros((self._num_operators, 2, 3, 21), dtype=np.float32)
+        self._operator_seen = np.zeros(self._num_operators, dtype=bool)
+        self._confidence[:] = 0
+        self._hands_visible = False
 
-    def _calculate_squared_distance(self, point_1: np.array, point_2: np.array) -> float:
-        """
-        Squared Euclidean distance between two points.
+        # forget tracked hands, the next frame runs the palm detector
+        self._backend.reset()
 
-        :param point_1: coordinates of point 1
-        :param point_2: coordinates of point 2
-        :return: Squared Euclidean distance between 2 points
+    @property
+    def model_complexity(self) -> int:
+        return self._backend.model_complexity
+
+    def set_model_complexity(self, model_complexity: int) -> None:
         """
+        Change the landmark model complexity of the backend, lower is faster.
 
-        return ((point_1 - point_2) ** 2).sum()
+        :param model_complexity: 0 (lite) or 1 (full)
+        """
+        self._backend.set_model_complexity(model_complexity)
 
     def _calculate_hand_centre(self, hand: np.array) -> tuple:
         """
@@ -51,31 +83,114 @@ class HandTracker:
 
     def get_hand_poses_from_frames(self, rgb_frames: list) -> np.array:
         """
-        Get hand vectors for all frames and return in list.
+        Get hand poses of consecutive frames, tracked in the given order.
 
         :param rgb_frames: Frames to calculate hand poses from
-        :param depth_frames: Depth frames to add depth value of hand centre
-        :return: list of hand poses
+        :return: float32 array of hand poses [frames, 3, 42], or [frames, operators, 3, 42] with several operators
         """
 
         hands = []
 
-        for frame, depth in zip(rgb_frames):
-            hand = self.get_hand_poses_from_frame(frame, depth)
+        for frame in rgb_frames:
+            hand = self.get_hand_poses_from_frame(frame)
             hands.append(hand)
 
-        return np.array(hands)
+        return np.array(hands, dtype=np.float32).reshape((-1,) + get_landmark_shape(self._num_operators))
 
-    def _get_vector_from_landmarks(self, landmarks: dict) -> np.array:
+    def _get_vectors_from_landmarks(self, multi_hand_landmarks: list) -> np.array:
         """
-        Transform landmark data into matrix of dimension [number of coordinate axis, number of landmarks]
+        Transform landmark data of all detected hands into one array of dimension
+        [number of hands, number of coordinate axis, number of landmarks]
 
-        :param landmarks: Landmark data calculated from mediapipe
-        :param depth_frame: depth frame to gather depth information of hand centre
-        :return: array of x, y and z coordinates for each landmark
+        :param multi_hand_landmarks: Landmark data of each hand calculated from mediapipe
+        :return: array of x, y and z coordinates for each landmark of each hand
         """
 
-        hands = np.transpose(np.array([[landmark.x, landmark.y, landmark.z] for landmark in landmarks]))
+        hands = np.array([[(landmark.x, landmark.y, landmark.z) for landmark in hand.landmark]
+                          for hand in multi_hand_landmarks], dtype=np.float32)
+
+        return hands.transpose(0, 2, 1)
+
+    def _get_roi(self, frame_shape: tuple):
+        """
+        Get the region around the hands of the previous frame, padded by ROI_PADDING.
+
+        :param frame_shape: shape of the full frame
+        :return: pixel limits (x_min, y_min, x_max, y_max) or None if the full frame should be searched
+        """
+        height, width = frame_shape[:2]
+        hands = self._last_hands.transpose(2, 0, 1, 3).reshape((3, -1))
+
+        # normalised limits of all hands, padded and clipped to the frame
+        x_min = max(hands[0].min() - constants.ROI_PADDING, 0)
+        x_max = min(hands[0].max() + constants.ROI_PADDING, 1)
+        y_min = max(hands[1].min() - constants.ROI_PADDING, 0)
+        y_max = min(hands[1].max() + constants.ROI_PADDING, 1)
+
+        # cropping is not worth it if the region covers most of the frame
+        if (x_max - x_min) * (y_max - y_min) > constants.ROI_MAX_AREA:
+            return None
+
+        return math.floor(x_min * width), math.floor(y_min * height), math.ceil(x_max * width), math.ceil(y_max * height)
+
+    def prepare_frame(self, rgb_frame: np.array) -> np.array:
+        """
+        Resize frame by the inference scale. Normalised landmark coordinates do not depend on the frame size,
+        since the aspect ratio is kept.
+
+        :param rgb_frame: captured frame
+        :return: frame to run the hand tracker on, only valid until the next call
+        """
+        if self._inference_scale == 1:
+            return rgb_frame
+
+        # allocate the resized frame once per capture size
+        height, width = rgb_frame.shape[:2]
+        inference_shape = (round(height * self._inference_scale), round(width * self._inference_scale), 3)
+        if self._inference_frame is None or self._inference_frame.shape != inference_shape:
+            self._inference_frame = np.empty(inference_shape, dtype=np.uint8)
+
+        cv.resize(rgb_frame, (inference_shape[1], inference_shape[0]), dst=self._inference_frame, interpolation=cv.INTER_AREA)
+        return self._inference_frame
+
+    def detect_hands(self, rgb_frame: np.array) -> np.array:
+        """
+        Run the hand tracker on a frame.
+
+        :param rgb_frame: frame to calculate hand landmarks
+        :return: array of hand vectors [hands, 3, 21] with normalised coordinates of the given frame,
+            their handedness scores are stored in detection_scores
+        """
+
+        hands, self.detection_scores = self._backend.process(rgb_frame)
+        return hands
+
+    def _detect_hands_in_roi(self, rgb_frame: np.array, roi: tuple) -> np.array:
+        """
+        Run the hand tracker on a region of the frame and map the landmarks back to full frame coordinates.
+
+        :param rgb_frame: full frame
+        :param roi: pixel limits (x_min, y_min, x_max, y_max) of the region
+        :return: array of hand vectors [hands, 3, 21] with normalised coordinates of the full frame
+        """
+        height, width = rgb_frame.shape[:2]
+        x_min, y_min, x_max, y_max = roi
+
+        # allocate the crop buffer once per frame size, a contiguous view holds the crop
+        if self._roi_buffer is None or self._roi_buffer.size < rgb_frame.size:
+            self._roi_buffer = np.empty(rgb_frame.size, dtype=rgb_frame.dtype)
+        crop_shape = (y_max - y_min, x_max - x_min) + rgb_frame.shape[2:]
+        crop = self._roi_buffer[:math.prod(crop_shape)].reshape(crop_shape)
+        np.copyto(crop, rgb_frame[y_min:y_max, x_min:x_max])
+
+        hands = self.detect_hands(crop)
+
+        # x and y are normalised by the crop size, z uses the same scale as x
+        scale_x = (x_max - x_min) / width
+        scale_y = (y_max - y_min) / height
+        hands[:, 0] = hands[:, 0] * scale_x + x_min / width
+        hands[:, 1] = hands[:, 1] * scale_y + y_min / height
+        hands[:, 2] *= scale_x
 
         return hands
 
@@ -84,60 +199,139 @@ class HandTracker:
         Calculate hand pose from rgb frame.
 
         :param rgb_frame: frame to calculate hand landmarks
-        :return: array of hand landmarks
+        :return: float32 array of hand landmarks [3, 42], or [operators, 3, 42] with several operators
+        """
+
+        # resize frame to the inference size
+        rgb_frame = self.prepare_frame(rgb_frame)
+
+        # calculate hand poses, around the previous hands if all were visible
+        hands = None
+        if self._roi_tracking and self._hands_visible:
+            roi = self._get_roi(rgb_frame.shape)
+            if roi is not None:
+                hands = self._detect_hands_in_roi(rgb_frame, roi)
+
+                # a hand was lost, search the full frame
+                if len(hands) < 2 * self._num_operators:
+                    hands = None
+
+        if hands is None:
+            hands = self.detect_hands(rgb_frame)
+        self._hands_visible = len(hands) >= 2 * self._num_operators
+
+        return self.get_hand_poses_from_detections(hands, self.detection_scores)
+
+    def get_hand_poses_from_detections(self, hands: np.array, scores: np.array = None) -> np.array:
+        """
+        Calculate hand pose from hands detected in a frame, used when detection runs elsewhere.
+        The confidence of the left and right hands is stored in hand_confidence.
+
+        :param hands: array of hand vectors [hands, 3, 21] returned by detect_hands
+        :param scores: handedness scores of the hands, None if unknown
+        :return: array of hand landmarks [3, 42], or [operators, 3, 42] with several operators
+        """
+        if scores is None:
+            scores = np.ones(len(hands), dtype=np.float32)
+
+        # update last hands of each operator with the detected ones, if no hand detected keep previous landmarks
+        if self._num_operators == 1:
+            self._assign_hands(hands, scores)
+        else:
+            for operator, indices in enumerate(self._assign_operators(hands)):
+                self._assign_hands(hands[indices], scores[indices], operator)
+
+        # left hand landmarks followed by the right hand landmarks of each operator
+        hand_poses = self._last_hands.transpose(0, 2, 1, 3).reshape((self._num_operators, 3, 42))
+        return hand_poses[0] if self._num_operators == 1 else hand_poses
+
+    def _assign_operators(self, hands: np.array) -> list:
+        """
+        Assign detected hands to operators, at most two hands per operator. Hands go to the closest known operator
+        within OPERATOR_MAX_DISTANCE, the remaining hands start new operators in pairs ordered by x coordinate,
+        and hands left after that go to the closest known operator with a free hand.
+
+        :param hands: array of hand vectors [hands, 3, 21]
+        :return: list with the indexes of the hands of each operator
+        """
+        operators = [[] for _ in range(self._num_operators)]
+        if len(hands) == 0:
+            return [np.array(indices, dtype=int) for indices in operators]
+
+        # squared distance of every hand centre to the closest last hand centre of every known operator
+        centres = (hands[:, :2, 0] + hands[:, :2, 9]) / 2
+        last_centres = (self._last_hands[:, :, :2, 0] + self._last_hands[:, :, :2, 9]) / 2
+        distances = ((centres[:, np.newaxis, np.newaxis] - last_centres[np.newaxis]) ** 2).sum(axis=-1).min(axis=-1)
+        distances[:, ~self._operator_seen] = np.inf
+        order = np.argsort(distances, axis=None)
+        assigned = np.zeros(len(hands), dtype=bool)
+
+        def assign_closest(max_distance: float) -> None:
+            # closest hand and operator pairs first
+            for hand, operator in zip(*np.unravel_index(order, distances.shape)):
+                if distances[hand, operator] > max_distance:
+                    break
+                if not assigned[hand] and len(operators[operator]) < 2:
+                    operators[operator].append(hand)
+                    assigned[hand] = True
+
+        assign_closest(constants.OPERATOR_MAX_DISTANCE ** 2)
+
+        # hands far from every known operator start new operators, the left hand has the larger x coordinate
+        remaining = np.flatnonzero(~assigned)
+        remaining = remaining[np.argsort(-centres[remaining, 0])]
+        new_operators = np.flatnonzero(~self._operator_seen)
+        for operator, first in zip(new_operators, range(0, len(remaining), 2)):
+            operators[operator] = list(remaining[first:first + 2])
+            assigned[remaining[first:first + 2]] = True
+
+        # an operator that moved far keeps its identity once no new operator can be started
+        assign_closest(np.inf)
+        return [np.array(indices, dtype=int) for indices in operators]
+
+    def _assign_hands(self, hands: np.array, scores: np.array, operator: int = 0) -> None:
         """
+        Assign detected hands to the left and right hands of an operator.
 
-        # calculate hand poses
-        rgb_frame.flags.writeable = False
-        hand_pose = self._hand_tracker.process(rgb_frame)
-        rgb_frame.flags.writeable = True
+        :param hands: array of hand vectors [hands, 3, 21]
+        :param scores: confidence of the hands
+        :param operator: operator the hands belong to
+        """
 
-        # if no hand detected, keep previous landmarks
-        if not hand_pose.multi_hand_landmarks:
-            return np.concatenate((self._last_left_hand, self._last_right_hand), axis=1)
+        # hands kept from a previous frame have no confidence
+        confidence = self._confidence[operator]
+        confidence[:] = 0
+        if len(hands) == 0:
+            return
+        self._operator_seen[operator] = True
+        last_hands = self._last_hands[operator]
 
-        if len(hand_pose.multi_hand_landmarks) == 1:
-            # get calculated hand
-            hand = self._get_vector_from_landmarks(hand_pose.multi_hand_landmarks[0].landmark)
+        # squared distance of every detected hand to the last left (column 0) and right (column 1) hands
+        distances = ((hands[:, np.newaxis] - last_hands[np.newaxis]) ** 2).sum(axis=(2, 3))
 
+        if len(hands) == 1:
             # find last hand closer to hand found and update its value
-            if self._calculate_squared_distance(hand, self._last_left_hand) < \
-                    self._calculate_squared_distance(hand, self._last_right_hand):
-                self._last_left_hand = hand
+            if distances[0, 0] < distances[0, 1]:
+                last_hands[0] = hands[0]
+                confidence[0] = scores[0]
             else:
-                self._last_right_hand = hand
-
-            # swap hands if x coordinate of the right hand is bigger than left
-            if self._calculate_hand_centre(self._last_left_hand)[0] < \
-                    self._calculate_hand_centre(self._last_right_hand)[0]:
-                self._last_left_hand, self._last_right_hand = self._last_right_hand, self._last_left_hand
-
-        elif len(hand_pose.multi_hand_landmarks) > 2:
-            # initialize best distance to hands
-            best_left_dist, best_right_dist = math.inf, math.inf
-
-            # for each found hand find the hand that is closer to the last left and right hands
-            for hand in hand_pose.multi_hand_landmarks:
-                hand_vector = self._get_vector_from_landmarks(hand.landmark)
-                left_dist = self._calculate_squared_distance(self._last_left_hand, hand_vector)
-                right_dist = self._calculate_squared_distance(self._last_right_hand, hand_vector)
-
-                # update closest hand to previous left hand
-                if left_dist < best_left_dist:
-                    self._last_left_hand = hand_vector
-                    best_left_dist = left_dist
-
-                # update closest hand to previous right hand
-                if right_dist < best_right_dist:
-                    self._last_right_hand = hand_vector
-                    best_right_dist = right_dist
-
-        elif len(hand_pose.multi_hand_landmarks) == 2:
-            # get 2 calculated hands and assign left to the hand on the left side
-            hand_1 = self._get_vector_from_landmarks(hand_pose.multi_hand_landmarks[0].landmark)
-            hand_2 = self._get_vector_from_landmarks(hand_pose.multi_hand_landmarks[1].landmark)
-
-            self._last_left_hand, self._last_right_hand = (hand_2, hand_1) if \
-                self._calculate_hand_centre(hand_1)[0] < self._calculate_hand_centre(hand_2)[0] else (hand_1, hand_2)
-
-        return np.concatenate((self._last_left_hand, self._last_right_hand), axis=1)
+                last_hands[1] = hands[0]
+                confidence[1] = scores[0]
+
+        elif len(hands) == 2:
+            # get 2 calculated hands, assigned by their position below
+            last_hands[:] = hands
+            confidence[:] = scores
+
+        else:
+            # optimal assignment, cost of hand i as left and hand j as right, a hand cannot take both
+            cost = distances[:, 0, np.newaxis] + distances[np.newaxis, :, 1]
+            np.fill_diagonal(cost, np.inf)
+            left, right = np.unravel_index(np.argmin(cost), cost.shape)
+            last_hands[:] = hands[left], hands[right]
+            confidence[:] = scores[left], scores[right]
+
+        # swap hands if x coordinate of the right hand is bigger than left
+        if self._calculate_hand_centre(last_hands[0])[0] < self._calculate_hand_centre(last_hands[1])[0]:
+            last_hands[:] = last_hands[::-1].copy()
+            confidence[:] = confidence[::-1].copy()
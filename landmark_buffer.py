@@ -0,0 +1,179 @@
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# flags stored with the landmarks of each slot
+REUSED_FLAG = 1
+KEEP_ALIVE_FLAG = 2
+
+def get_landmark_shape(num_operators: int) -> tuple:
+    """
+    Shape of the landmarks of a frame, with a leading operator dimension only if several operators are tracked.
+
+    :param num_operators: number of operators tracked
+    :return: (3, 42) for a single operator, (operators, 3, 42) otherwise
+    """
+    return (3, 42) if num_operators == 1 else (num_operators, 3, 42)
+
+# lock-free ring buffer in shared memory to pass landmarks from a single producer to a single consumer
+class LandmarkRingBuffer:
+    # size reserved for the header, keeps the slots aligned
+    _HEADER_SIZE = 64
+
+    def __init__(self, capacity: int, landmark_shape: tuple = (3, 42)):
+        self.capacity = capacity
+        self.landmark_shape = tuple(landmark_shape)
+        self._slot_dtype = self._get_slot_dtype(self.landmark_shape)
+
+        # shared memory block with a header (number of published slots) followed by the slots
+        self._shm = shared_memory.SharedMemory(create=True, size=self._HEADER_SIZE + capacity * self._slot_dtype.itemsize)
+        self._owner_pid = os.getpid()
+        self._attach_views()
+        self._written[0] = 0
+        self._slots["sequence"] = -1
+
+        # event used to wake up the consumer, the data path itself does not lock
+        self._doorbell = mp.Event()
+
+        # position of the consumer and number of slots it lost because the producer lapped it
+        self._next_read = 0
+        self.lost = 0
+
+    @staticmethod
+    def _get_slot_dtype(landmark_shape: tuple) -> np.dtype:
+        """
+        Memory layout of a single slot.
+
+        :param landmark_shape: shape of the landmark array stored in each slot
+        :return: structured dtype of the slot
+        """
+        # one confidence value per hand, left and right
+        # publication time uses the monotonic clock shared by all processes (time.perf_counter)
+        return np.dtype([("sequence", np.int64), ("timestamp", np.float64), ("published", np.float64), ("flags", np.uint32),
+                         ("confidence", np.float32, landmark_shape[:-2] + (2,)),
+                         ("landmarks", np.float32, landmark_shape)], align=True)
+
+    def _attach_views(self) -> None:
+        """
+        Create NumPy views over the shared memory block.
+        """
+        self._written = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._slots = np.ndarray((self.capacity,), dtype=self._slot_dtype, buffer=self._shm.buf, offset=self._HEADER_SIZE)
+
+    def __getstate__(self):
+        # only the shared memory name is sent to child processes, views are recreated on attach
+        return {"name": self._shm.name, "capacity": self.capacity, "landmark_shape": self.landmark_shape,
+                "doorbell": self._doorbell}
+
+    def __setstate__(self, state):
+        self.capacity = state["capacity"]
+        self.landmark_shape = state["landmark_shape"]
+        self._slot_dtype = self._get_slot_dtype(self.landmark_shape)
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._owner_pid = None
+        self._attach_views()
+        self._doorbell = state["doorbell"]
+        self._next_read = int(self._written[0])
+        self.lost = 0
+
+    def write(self, landmarks: np.array, timestamp: float, flags: int = 0, confidence: np.array = None) -> int:
+        """
+        Publish landmarks in the next slot. Only one process may write.
+
+        :param landmarks: landmark array with the buffer landmark shape
+        :param timestamp: capture timestamp of the frame the landmarks come from [s]
+        :param flags: combination of the slot flags, e.g. REUSED_FLAG | KEEP_ALIVE_FLAG
+        :param confidence: detection confidence of each hand, None if unknown (full confidence)
+        :return: sequence number of the published slot
+        """
+        sequence = int(self._written[0])
+        slot = self._slots[sequence % self.capacity]
+
+        # invalidate slot while it is written, the consumer discards slots whose sequence does not match
+        slot["sequence"] = -1
+        slot["timestamp"] = timestamp
+        slot["published"] = time.perf_counter()
+        slot["flags"] = flags
+        slot["confidence"] = 1 if confidence is None else confidence
+        slot["landmarks"] = landmarks
+        slot["sequence"] = sequence
+
+        # publish slot and wake up the consumer
+        self._written[0] = sequence + 1
+        self._doorbell.set()
+        return sequence
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait until there are unread landmarks.
+
+        :param timeout: maximum waiting time [s]
+        :return: True if landmarks are available, False otherwise
+        """
+        if self._written[0] > self._next_read:
+            return True
+
+        # clear before checking again, so a slot published in between is never missed
+        self._doorbell.clear()
+        if self._written[0] > self._next_read:
+            return True
+        self._doorbell.wait(timeout)
+        return self._written[0] > self._next_read
+
+    def read(self):
+        """
+        Get the oldest unread landmarks as a view into shared memory (no copy). Only one process may read.
+        The view is only guaranteed to hold the published values while is_valid returns True for its sequence.
+
+        :return: tuple (sequence, timestamp, flags, landmarks view, confidence view) or None if there are no unread landmarks
+        """
+        while True:
+            written = int(self._written[0])
+            if written <= self._next_read:
+                return None
+
+            # skip slots overwritten by the producer, leaving a margin for the slot being written
+            if written - self._next_read >= self.capacity:
+                oldest = written - self.capacity + 1
+                self.lost += oldest - self._next_read
+                self._next_read = oldest
+
+            sequence = self._next_read
+            self._next_read += 1
+            slot = self._slots[sequence % self.capacity]
+            if slot["sequence"] != sequence:
+                self.lost += 1
+                continue
+
+            return sequence, float(slot["timestamp"]), int(slot["flags"]), slot["landmarks"], slot["confidence"]
+
+    def get_published_time(self, sequence: int) -> float:
+        """
+        Get the time a slot was published, to measure how long landmarks waited in the buffer.
+
+        :param sequence: sequence number returned by read
+        :return: time.perf_counter() value at publication, only meaningful while is_valid returns True
+        """
+        return float(self._slots[sequence % self.capacity]["published"])
+
+    def is_valid(self, sequence: int) -> bool:
+        """
+        Check if the slot of a sequence still holds its landmarks, i.e. was not overwritten meanwhile.
+
+        :param sequence: sequence number returned by read
+        :return: True if the slot still holds the given sequence
+        """
+        return self._slots[sequence % self.capacity]["sequence"] == sequence
+
+    def close(self) -> None:
+        """
+        Release the views and close the shared memory block, the creator also removes it.
+        """
+        self._written = None
+        self._slots = None
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
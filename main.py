@@ -88,14 +88,17 @@ def main():
                 robot_online_event.clear()
                 system_proc = mp.Process(target=run_system, args=(stop_event, model_ready_event, robot_online_event))
                 system_proc.start()
+                start_time = time.time()
 
-                # wait for system ready events and buzz accordingly
-                if model_ready_event.wait(timeout=10):
+                # wait for system ready events and buzz accordingly, the robot connects while the models start
+                if model_ready_event.wait(timeout=constants.MODEL_READY_TIMEOUT):
                     logger.info("Model ready, notifying Arduino")
                     send_buzz(ser, 300, 250)
                     send_buzz(ser, 600, 250)
-                    if robot_online_event.wait(timeout=5):
+                    if robot_online_event.wait(timeout=max(start_time + constants.ROBOT_ONLINE_TIMEOUT - time.time(), 5)):
                         send_buzz(ser, 900, 250)
+                    else:
+                        logger.warning("Robot failed to come online in time")
                 else:
                     logger.warning("Model failed to signal readiness in time")
     
@@ -1,4 +1,5 @@
 import torch
+from torch.func import functional_call, stack_module_state, vmap
 import time
 import numpy as np
 import logging
@@ -7,6 +8,11 @@ import glob
 import os
 from settings import constants
 from collections import deque
+from frame_sampler import TemporalResampler, get_visible_hands
+from landmark_buffer import REUSED_FLAG, KEEP_ALIVE_FLAG
+from preprocessing import AllocationMonitor
+from prefilter import KinematicPrefilter
+from governor import GovernorState, StageLatency, get_degradation_setting
 
 
 # define logging file for the model process
@@ -62,7 +68,22 @@ class GraphTransformer(torch.nn.Module):
         x = self.output_layer(x)
         return x
     
-def load_models():
+def get_device() -> torch.device:
+    """
+    Get the device the models run on and, on the CPU, set the thread counts of PyTorch.
+    Inter-op threads can only be set before PyTorch runs parallel work, so this is called once when the process starts.
+
+    :return: device selected by MODEL_DEVICE
+    """
+    device = torch.device(constants.MODEL_DEVICE)
+    if device.type == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("MODEL_DEVICE is cuda but no GPU is available, set MODEL_DEVICE to cpu")
+    if device.type == "cpu":
+        torch.set_num_threads(constants.CPU_INTRA_OP_THREADS)
+        torch.set_num_interop_threads(constants.CPU_INTER_OP_THREADS)
+    return device
+
+def load_models(device: torch.device):
     classification_models = []
     segmentation_models = []
     
@@ -71,9 +92,9 @@ def load_models():
         model = GraphTransformer(3, 6, edge_index, 42, constants.C_NUM_BLOCKS, constants.C_HIDDEN_DIM, constants.C_TEMPORAL_STRIDE, constants.C_RESIDUAL, 
                                  constants.C_ADAPTIVE, constants.C_ATTENTION,constants.C_FC_LAYERS, constants.C_FC_UNITS, constants.C_FC_DROPOUT)
         
-        state_dict = torch.load(model_path, map_location="cuda")
+        state_dict = torch.load(model_path, map_location=device)
         model.load_state_dict(state_dict, strict=True)
-        model.to("cuda")
+        model.to(device)
         model.eval()  
         classification_models.append(model)
 
@@ -82,42 +103,336 @@ def load_models():
         model = GraphTransformer(3, 1, edge_index, 42, constants.S_NUM_BLOCKS, constants.S_HIDDEN_DIM, constants.S_TEMPORAL_STRIDE, constants.S_RESIDUAL, 
                                  constants.S_ADAPTIVE, constants.S_ATTENTION,constants.S_FC_LAYERS, constants.S_FC_UNITS, constants.S_FC_DROPOUT)
         
-        state_dict = torch.load(model_path, map_location="cuda")
+        state_dict = torch.load(model_path, map_location=device)
         model.load_state_dict(state_dict, strict=True)
-        model.to("cuda")
+        model.to(device)
         model.eval()  
         segmentation_models.append(model)
     
     return classification_models, segmentation_models
 
-def model_worker(frame_queue, result_queue, stop_event, model_ready_event, moving_flag):
+# ensemble of models with the same architecture, all members run in a single vectorized call over their stacked parameters
+class ModelEnsemble(torch.nn.Module):
+    def __init__(self, models: list, vectorized: bool = constants.VECTORIZED_ENSEMBLES):
+        super(ModelEnsemble, self).__init__()
+        if not models:
+            raise ValueError("An ensemble needs at least one model")
+        self.members = torch.nn.ModuleList(models)
+
+        # parameters and buffers of every member stacked along a new first dimension, the first member provides the code
+        self._params, self._buffers = stack_module_state(list(models)) if vectorized else ({}, {})
+
+        # None until the first call has checked the vectorized call, False if the members run one by one
+        self._vectorized = None if vectorized else False
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def _call_member(self, params: dict, buffers: dict, x: torch.Tensor) -> torch.Tensor:
+        return functional_call(self.members[0], (params, buffers), (x,))
+
+    def _forward_vectorized(self, x: torch.Tensor, num_models: int) -> torch.Tensor:
+        params = {name: param[:num_models] for name, param in self._params.items()}
+        buffers = {name: buffer[:num_models] for name, buffer in self._buffers.items()}
+        return vmap(self._call_member, in_dims=(0, 0, None))(params, buffers, x)
+
+    def _forward_loop(self, x: torch.Tensor, num_models: int) -> torch.Tensor:
+        return torch.stack([model(x) for model in self.members[:num_models]], dim=0)
+
+    def forward(self, x: torch.Tensor, num_models: int = None) -> torch.Tensor:
+        """
+        Run the first members of the ensemble on the same input.
+
+        :param x: input of every member
+        :param num_models: number of members to run, all if None
+        :return: output of each member, stacked along the first dimension
+        """
+        num_models = len(self.members) if num_models is None else num_models
+
+        # the first call checks the vectorized call against the members, models it does not support run one by one
+        if self._vectorized is None:
+            looped = self._forward_loop(x, len(self.members))
+            try:
+                self._vectorized = torch.allclose(self._forward_vectorized(x, len(self.members)), looped, rtol=1e-4, atol=1e-5)
+            except Exception:
+                logger.warning("Vectorized ensemble call failed, members run one by one", exc_info=True)
+                self._vectorized = False
+            if not self._vectorized:
+                logger.warning("Vectorized ensemble call does not match the members, members run one by one")
+            return looped[:num_models]
+
+        if self._vectorized:
+            return self._forward_vectorized(x, num_models)
+        return self._forward_loop(x, num_models)
+
+# ring buffer of the last landmarks of each operator, shared by the segmentation and classification windows
+# every frame is written twice, one buffer length apart, so the last frames are always a single ordered slice
+class SequenceBuffer:
+    def __init__(self, num_operators: int, length: int, device: torch.device):
+        self.length = length
+        self._frames = torch.zeros((num_operators, 3, 2 * length, 42), device=device)
+        self._next = 0
+
+    def append(self, frame: torch.Tensor) -> None:
+        """
+        Add the landmarks of a frame, replacing the oldest ones.
+
+        :param frame: landmarks [3, 42] or [operators, 3, 42]
+        """
+        self._frames[:, :, self._next, :] = frame
+        self._frames[:, :, self._next + self.length, :] = frame
+        self._next = (self._next + 1) % self.length
+
+    def get_window(self, length: int) -> torch.Tensor:
+        """
+        Get the last frames in order, copied into a contiguous tensor for the models.
+
+        :param length: number of frames, at most the buffer length
+        :return: landmarks [operators, 3, length, 42], the newest frame last
+        """
+        end = self._next + self.length
+        return self._frames[:, :, end - length:end, :].contiguous()
+
+def prepare_ensemble(name: str, models: list, device: torch.device, sequence_length: int, batch_sizes: list,
+                     member_counts: list) -> ModelEnsemble:
+    """
+    Create an ensemble, compile it as set by MODEL_COMPILE and warm it up on every input shape and number of members
+    it will run with, so the first predictions do not pay for lazy initialisation, allocator growth or kernel selection.
+
+    :param name: name of the ensemble, for the logs
+    :param models: models of the ensemble
+    :param device: device the models run on
+    :param sequence_length: number of frames of the model input
+    :param batch_sizes: batch sizes (operators) the ensemble runs with
+    :param member_counts: numbers of members the ensemble runs with, e.g. at each degradation level
+    :return: ensemble ready to predict
+    """
+    ensemble = ModelEnsemble(models)
+    examples = [torch.rand((batch_size, 3, sequence_length, 42), device=device) for batch_size in batch_sizes]
+
+    # the first call checks the vectorized call, so it is made before compiling
+    with torch.inference_mode():
+        ensemble(examples[0])
+
+    start = time.perf_counter()
+    if constants.MODEL_COMPILE == "torchscript":
+        # traced members are run one by one, the vectorized call needs the python modules
+        with torch.no_grad():
+            compiled_ensemble = ModelEnsemble([torch.jit.trace(model, examples[0]) for model in models], vectorized=False)
+    elif constants.MODEL_COMPILE == "compile":
+        compiled_ensemble = torch.compile(ensemble)
+    elif constants.MODEL_COMPILE is None:
+        compiled_ensemble = ensemble
+    else:
+        raise ValueError(f"MODEL_COMPILE {constants.MODEL_COMPILE} is not valid! Use torchscript, compile or None")
+    compile_time = time.perf_counter() - start
+
+    # torch.compile compiles on the first calls, a model it cannot compile runs uncompiled
+    start = time.perf_counter()
+    try:
+        with torch.inference_mode():
+            for _ in range(constants.MODEL_WARMUP_RUNS):
+                for example in examples:
+                    for member_count in member_counts:
+                        compiled_ensemble(example, member_count)
+        synchronize(device)
+    except Exception:
+        if compiled_ensemble is ensemble:
+            raise
+        logger.warning(f"Compiled {name} ensemble failed, running it uncompiled", exc_info=True)
+        return ensemble
+
+    logger.info(f"{name.capitalize()} ensemble ready, {len(models)} models"
+                + (f", compiled ({constants.MODEL_COMPILE}) in {compile_time:.1f} s" if constants.MODEL_COMPILE is not None else "")
+                + f", warm-up in {time.perf_counter() - start:.1f} s")
+    return compiled_ensemble
+
+def synchronize(device: torch.device) -> None:
+    """
+    Wait for the work queued on the device, so it can be timed.
+
+    :param device: device the models run on
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+def benchmark_models(classification_ensemble: ModelEnsemble, segmentation_ensemble: ModelEnsemble, device: torch.device, runs: int) -> None:
+    """
+    Measure and log the latency of each ensemble on inputs shaped like those of the model process, to size the hardware of a cell.
+
+    :param classification_ensemble: classification models
+    :param segmentation_ensemble: segmentation models
+    :param device: device the models run on
+    :param runs: timed runs per ensemble, after one warm-up run
+    """
+    ensembles = [("segmentation", segmentation_ensemble, torch.rand((constants.NUM_OPERATORS, 3, constants.S_SEQ_LEN, 42), device=device)),
+                 ("classification", classification_ensemble, torch.rand((1, 3, constants.C_SEQ_LEN, 42), device=device))]
+    for name, models, sequence in ensembles:
+        latencies = []
+        with torch.inference_mode():
+            for run in range(runs + 1):
+                start = time.perf_counter()
+                models(sequence)
+                synchronize(device)
+                if run > 0:
+                    latencies.append(1000 * (time.perf_counter() - start))
+        latencies = np.array(latencies)
+        logger.info(f"Benchmark {name} ensemble ({len(models)} models, batch {len(sequence)}) on {device}: "
+                    f"mean {latencies.mean():.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms, "
+                    f"{latencies.mean() / len(models):.1f} ms per model")
+
+# sliding window of segmentation predictions of an operator, split in two halves to detect the end of a movement
+class TimingWindow:
+    def __init__(self, size: int = constants.TIMING_WINDOW, threshold: float = constants.TIMING_THRESHOLD):
+        self._size = size
+        self._half = size // 2
+        self._threshold = threshold
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Clear the predictions and the count of each window half.
+        """
+        self._predictions = deque([])
+        self._left_sum = 0
+        self._right_sum = 0
+
+    def add(self, prediction: float) -> bool:
+        """
+        Add a segmentation prediction.
+
+        :param prediction: segmentation prediction, human movement (0) or static (1)
+        :return: True if a timing was predicted
+        """
+        if len(self._predictions) < self._size:
+            # fill segmentation queue until it reaches full size
+            self._predictions.append(prediction)
+
+            # update count of each window half
+            if len(self._predictions) <= self._half:
+                self._left_sum += prediction
+            else:
+                self._right_sum += prediction
+            return False
+
+        # append new segmentation prediction and pop first prediction in the queue
+        # update count of each window half
+        self._right_sum -= self._predictions[self._half]
+        self._left_sum += self._predictions[self._half]
+        self._left_sum -= self._predictions.popleft()
+        self._right_sum += prediction
+        self._predictions.append(prediction)
+
+        # metric to decide when there is a transition between human movement (0) and static (1)
+        # intuition is there must be more new static predictions (right window) and more old movement predictions (left window)
+        return self._right_sum - self._left_sum > self._threshold * self._half
+
+def model_worker(landmark_buffer, result_queue, stop_event, model_ready_event, moving_flag, governor_state: GovernorState = None):
     logger.info("Model worker started")
 
-    # load classification and segmentation models
-    classification_models, segmentation_models = load_models()
-    logger.info("Models sucessfully loaded")
+    # load classification and segmentation models on the configured device
+    start = time.perf_counter()
+    device = get_device()
+    classification_models, segmentation_models = load_models(device)
+    logger.info(f"Models sucessfully loaded on {device} in {time.perf_counter() - start:.1f} s"
+                + (f" ({torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op threads)" if device.type == "cpu" else ""))
+
+    # ensembles run their members in one vectorized call, they are compiled and warmed up with every number of
+    # operators and members they can run with before the system becomes ready
+    segmentation_counts = [len(segmentation_models)]
+    classification_counts = [len(classification_models)]
+    if constants.LATENCY_GOVERNOR:
+        segmentation_counts = sorted({min(get_degradation_setting(level, "segmentation_models", len(segmentation_models)), len(segmentation_models))
+                                      for level in range(len(constants.DEGRADATION_LEVELS))})
+        classification_counts = sorted({min(get_degradation_setting(level, "classification_models", len(classification_models)), len(classification_models))
+                                        for level in range(len(constants.DEGRADATION_LEVELS))})
+    segmentation_ensemble = prepare_ensemble("segmentation", segmentation_models, device, constants.S_SEQ_LEN,
+                                             [constants.NUM_OPERATORS], segmentation_counts)
+    classification_ensemble = prepare_ensemble("classification", classification_models, device, constants.C_SEQ_LEN,
+                                               list(range(1, constants.NUM_OPERATORS + 1)), classification_counts)
+
+    # latency of each ensemble, reported before the system becomes ready
+    if constants.MODEL_BENCHMARK:
+        benchmark_models(classification_ensemble, segmentation_ensemble, device, constants.MODEL_BENCHMARK_RUNS)
     ready = False
     last_heartbeat = time.time()
 
-    # create sequences for the classification and segmentation
-    c_sequence_queue = torch.zeros((1, 3, constants.C_SEQ_LEN, 42)).to("cuda")
-    s_sequence_queue = torch.zeros((1, 3, constants.S_SEQ_LEN, 42)).to("cuda")
+    # create sequence for the classification and segmentation, the segmentation window holds the last frames
+    # operators are the batch dimension of the models
+    num_operators = constants.NUM_OPERATORS
+    sequence_buffer = SequenceBuffer(num_operators, max(constants.C_SEQ_LEN, constants.S_SEQ_LEN), device)
+
+    # landmarks are staged in a buffer allocated once, page-locked on the GPU so they are copied without a temporary buffer,
+    # on the CPU the staging buffer is used directly
+    host_frame = torch.empty(landmark_buffer.landmark_shape, dtype=torch.float32)
+    if device.type == "cuda":
+        host_frame = host_frame.pin_memory()
+    host_frame_view = host_frame.numpy()
+    device_frame = torch.empty(landmark_buffer.landmark_shape, dtype=torch.float32, device=device) if device.type == "cuda" else host_frame
+    allocation_monitor = AllocationMonitor(constants.PROFILE_ALLOCATIONS)
 
-    # create queue for the segmentation results
-    segmentation_queue = deque([])
-    half_window = constants.TIMING_WINDOW // 2
-    left_segmentation_sum = 0
-    right_segmentation_sum = 0
+    # timing decisions of each operator and operators whose hands were both detected, the others are not segmented
+    timing_windows = [TimingWindow() for _ in range(num_operators)]
+    operator_ready = np.zeros(num_operators, dtype=bool)
+
+    # cheap segmentation of clearly moving or static hands, the ensemble only runs if an operator is uncertain
+    prefilter = KinematicPrefilter(num_operators) if constants.KINEMATIC_PREFILTER else None
+    skipped_ensembles = 0
     last_moving_flag = False
+    reused_frames = 0
+    keep_alive_frames = 0
+
+    # full-rate frames received since the last keep-alive frame, the models wait for a pre-roll after the robot stops,
+    # at startup the sequences start from zeros and the models run right away
+    full_rate_frames = constants.ROBOT_PREROLL_FRAMES
+
+    # resampler to the fixed model rate, frames arrive at a varying rate with adaptive sampling or a latency governor
+    resampler = TemporalResampler((constants.SKIP_FRAMES + 1) / constants.STREAM_FPS) \
+        if constants.ADAPTIVE_SAMPLING or constants.LATENCY_GOVERNOR else None
+
+    # latency from published landmarks to predictions, reported to the governor, and ensemble size of its level
+    stage_latency = StageLatency(governor_state, GovernorState.MODEL_STAGE) if governor_state is not None else None
+    num_segmentation_models = len(segmentation_models)
+    num_classification_models = len(classification_models)
 
     try:
         while not stop_event.is_set():
-            if not frame_queue.empty():
-                # get landmarks from queue
-                frame = frame_queue.get()
+            # wait for the camera to publish landmarks, entries are read as views into shared memory
+            entry = landmark_buffer.read() if landmark_buffer.wait(timeout=0.1) else None
+            if entry is not None:
+                sequence, timestamp, flags, frame, _ = entry
+                published = landmark_buffer.get_published_time(sequence)
+
+                # ensemble members used at the degradation level set by the governor
+                if governor_state is not None:
+                    level = governor_state.level.value
+                    num_segmentation_models = get_degradation_setting(level, "segmentation_models", len(segmentation_models))
+                    num_classification_models = get_degradation_setting(level, "classification_models", len(classification_models))
+
+                # count landmarks the camera reused from the previous frame because the scene did not change
+                if flags & REUSED_FLAG:
+                    reused_frames += 1
+
+                # landmarks tracked at the keep-alive rate while the robot moves are not added to the sequences,
+                # they would compress time in the sequences the models were trained on
+                if flags & KEEP_ALIVE_FLAG:
+                    keep_alive_frames += 1
+                    full_rate_frames = 0
+                    if prefilter is not None:
+                        prefilter.reset()
+                    continue
+
+                # copy landmarks out of shared memory into the staging buffer
+                np.copyto(host_frame_view, frame)
+
+                # discard landmarks if the camera overwrote the slot while they were copied, before they are used
+                if not landmark_buffer.is_valid(sequence):
+                    logger.warning("Landmarks overwritten while reading, frame dropped")
+                    continue
 
-                # wait to detect both hands
-                if frame[:, :21].sum() < 0.001 or frame[:, 21:].sum() < 0.001:
+                # wait to detect both hands of an operator, hands are kept once detected
+                operator_ready |= get_visible_hands(host_frame_view.reshape((-1, 3, 42))).all(axis=-1)
+                if not operator_ready.any():
                     if time.time() - last_heartbeat > 4.5:
                         logger.info("Waiting to detect both hands...")
                     continue
@@ -128,83 +443,97 @@ def model_worker(frame_queue, result_queue, stop_event, model_ready_event, movin
                     model_ready_event.set()
                     ready = True
 
-                # update queues with the received landmarks (pops first landmarks and appends new landmarks)
-                new_frame = torch.from_numpy(frame).pin_memory().to("cuda", non_blocking=True)
-                s_sequence_queue[0, :, :-1, :] = s_sequence_queue[0, :, 1:, :]  # shift left
-                s_sequence_queue[0, :, -1, :] = new_frame  # append new frame
-                c_sequence_queue[0, :, :-1, :] = c_sequence_queue[0, :, 1:, :]  # shift left
-                c_sequence_queue[0, :, -1, :] = new_frame  # append new frame
-
-                # segment only if robot is not moving
-                if not moving_flag.value:
-                    if last_moving_flag:
-                        # inform that robot has stopped and the models are back online
-                        last_moving_flag = not last_moving_flag
-                        logger.info("Robot stopped, waking models...")
-                    with torch.no_grad():
-                        seg_preds = []
-                        # get segmentation prediction for each segmentation model
-                        for model in segmentation_models:
-                            pred = model(s_sequence_queue[:, :, -constants.S_SEQ_LEN:, :])
-                            pred = pred.squeeze(-1)
-                            pred = torch.sigmoid(pred)
-                            seg_preds.append(pred)
-
-                        # predict segmentation by averaging predictions (ensemble prediction)
-                        seg_preds = torch.stack(seg_preds, dim=0)
-                        mean_seg_pred = seg_preds.mean(dim=0)
-                        mean_seg_pred = (mean_seg_pred > 0.5).float().cpu().item()
-                        logger.debug(f"Segmentation result: {mean_seg_pred}")
-                    
-                    if len(segmentation_queue) < constants.TIMING_WINDOW:
-                        # fill segmentation queue until it reaches full size
-                        segmentation_queue.append(mean_seg_pred)
-
-                        # update count of each window half
-                        if len(segmentation_queue) <= half_window:
-                            left_segmentation_sum += mean_seg_pred
+                # with adaptive sampling, resample landmarks to the fixed rate the models were trained on
+                frames = [host_frame_view] if resampler is None else resampler.add(host_frame_view, timestamp)
+
+                for frame in frames:
+                    allocation_monitor.begin()
+
+                    # resampled landmarks replace the received ones in the staging buffer
+                    if frame is not host_frame_view:
+                        np.copyto(host_frame_view, frame)
+
+                    # update the sequence with the received landmarks (replaces the oldest landmarks)
+                    # the copy is synchronous, the staging buffer is overwritten by the next landmarks
+                    new_frame = device_frame.copy_(host_frame) if device_frame is not host_frame else host_frame
+                    sequence_buffer.append(new_frame)
+                    full_rate_frames += 1
+                    if prefilter is not None:
+                        prefilter.add(host_frame_view.reshape((num_operators, 3, 42)))
+
+                    if moving_flag.value:
+                        last_moving_flag = True
+
+                    # segment only if robot is not moving and the classification sequence was refilled at full rate,
+                    # otherwise it would join landmarks from before and after the robot task
+                    elif full_rate_frames >= constants.ROBOT_PREROLL_FRAMES:
+                        if last_moving_flag:
+                            # inform that robot has stopped and the models are back online
+                            last_moving_flag = not last_moving_flag
+                            logger.info("Robot stopped, waking models...")
+                        # segmentation of the operators the prefilter decided, NaN for the others
+                        if prefilter is not None:
+                            mean_seg_pred = prefilter.classify(operator_ready)
+                        else:
+                            mean_seg_pred = np.full(num_operators, np.nan, dtype=np.float32)
+
+                        if np.isnan(mean_seg_pred[operator_ready]).any():
+                            with torch.inference_mode():
+                                # get segmentation prediction of each segmentation model [models, operators],
+                                # all models and operators in one forward pass
+                                seg_preds = segmentation_ensemble(sequence_buffer.get_window(constants.S_SEQ_LEN), num_segmentation_models)
+                                seg_preds = torch.sigmoid(seg_preds.squeeze(-1))
+
+                                # predict segmentation by averaging predictions (ensemble prediction)
+                                ensemble_pred = seg_preds.mean(dim=0)
+                                ensemble_pred = (ensemble_pred > 0.5).float().cpu().numpy()
+                                mean_seg_pred = np.where(np.isnan(mean_seg_pred), ensemble_pred, mean_seg_pred)
                         else:
-                            right_segmentation_sum += mean_seg_pred
-                    else:
-                        # append new segmentation prediction and pop first prediction in the queue
-                        # update count of each window half
-                        right_segmentation_sum -= segmentation_queue[half_window]
-                        left_segmentation_sum += segmentation_queue[half_window]
-                        left_segmentation_sum -= segmentation_queue.popleft()
-                        right_segmentation_sum += mean_seg_pred
-                        segmentation_queue.append(mean_seg_pred)
-
-                        # metric to decide when there is a transition between human movement (0) and static (1)
-                        # intuition is there must be more new static predictions (right window) and more old movement predictions (left window)
-                        if right_segmentation_sum - left_segmentation_sum > constants.TIMING_THRESHOLD*half_window:
-                            logger.info("Timing predicted!")
-                            with torch.no_grad():
-                                class_preds = []
-
-                                # get classification predictions from all models
-                                for model in classification_models:
-                                    pred = model(c_sequence_queue)
-                                    pred = torch.softmax(pred, dim=1)
-                                    class_preds.append(pred)
-
-                                # average predictions to get a single ensemble class prediction
-                                class_preds = torch.stack(class_preds, dim=0)
+                            skipped_ensembles += 1
+                        logger.debug(f"Segmentation result: {mean_seg_pred}")
+
+                        # timing decisions stay per operator
+                        timed_operators = [int(operator) for operator in np.flatnonzero(operator_ready)
+                                           if timing_windows[operator].add(mean_seg_pred[operator])]
+                        if timed_operators:
+                            logger.info("Timing predicted!" if num_operators == 1 else f"Timing predicted for operators {timed_operators}!")
+                            with torch.inference_mode():
+                                # get classification predictions from all models [models, operators, classes],
+                                # for every timed operator in one forward pass
+                                class_preds = classification_ensemble(sequence_buffer.get_window(constants.C_SEQ_LEN)[timed_operators], num_classification_models)
+                                class_preds = torch.softmax(class_preds, dim=2)
+
+                                # average predictions to get a single ensemble class prediction per operator
                                 mean_class_pred = class_preds.mean(dim=0)
-                                class_final = torch.argmax(mean_class_pred, dim=1).cpu().item()
-                                result_queue.put(class_final)
+                                for class_final in torch.argmax(mean_class_pred, dim=1).cpu().tolist():
+                                    result_queue.put(class_final)
 
-                            # activate robot moving flag and reset segmentation queue and window counts
+                            # activate robot moving flag and reset the timing windows of all operators
                             logger.info("Trigger sent to robot, models in sleep mode!")
                             moving_flag.value = True
-                            segmentation_queue = deque([])
-                            left_segmentation_sum = 0
-                            right_segmentation_sum = 0
+                            for timing_window in timing_windows:
+                                timing_window.reset()
+
+                    allocation_monitor.end(1)
+
+                # latency from publication to predictions, including the time the landmarks waited in the buffer
+                if stage_latency is not None and frames:
+                    stage_latency.add(time.perf_counter() - published)
 
             if time.time() - last_heartbeat > 5:
-                logger.info("Model still processing...")
+                logger.info(f"Model still processing... lost {landmark_buffer.lost} landmark frames, "
+                            f"{reused_frames} reused by the camera, {keep_alive_frames} keep-alive frames")
+                if prefilter is not None:
+                    logger.info(f"Prefilter decided {prefilter.decided} of {prefilter.total} segmentations, "
+                                f"skipped the segmentation ensemble {skipped_ensembles} times")
+                    prefilter.reset_counters()
+                    skipped_ensembles = 0
+                if allocation_monitor.enabled:
+                    logger.info(f"Model allocations: {allocation_monitor.summary()}")
+                    allocation_monitor.reset()
                 last_heartbeat = time.time()
-
-            time.sleep(0.01)
+                reused_frames = 0
+                keep_alive_frames = 0
 
     except Exception as e:
         logger.error("Model worker crashed", exc_info=True)
@@ -0,0 +1,77 @@
+import numpy as np
+from settings import constants
+from frame_sampler import get_visible_hands
+
+
+def get_velocity_energy(frames: np.array) -> np.array:
+    """
+    Mean squared landmark displacement between consecutive frames, over the hands visible in both frames.
+
+    :param frames: normalised landmarks of consecutive frames with shape [frames, ..., 3, 42]
+    :return: velocity energy with shape [...], zero if no hand is visible in consecutive frames
+    """
+    # landmarks of hands missing in one of two consecutive frames are excluded
+    visible = get_visible_hands(frames[1:]) & get_visible_hands(frames[:-1])
+    visible = np.repeat(visible, 21, axis=-1)[..., np.newaxis, :]
+    squared_displacement = np.where(visible, (frames[1:] - frames[:-1]) ** 2, 0).sum(axis=-2)
+    landmarks = visible[..., 0, :].sum(axis=(0, -1))
+    return squared_displacement.sum(axis=(0, -1)) / np.maximum(landmarks, 1)
+
+# cheap segmentation of clearly moving or clearly static hands from the landmark velocity, the segmentation ensemble
+# only runs for the operators in the uncertain band between the thresholds
+class KinematicPrefilter:
+    def __init__(self, num_operators: int, window: int = constants.PREFILTER_WINDOW,
+                 static_energy: float = constants.PREFILTER_STATIC_ENERGY, moving_energy: float = constants.PREFILTER_MOVING_ENERGY):
+        self._static_energy = static_energy
+        self._moving_energy = moving_energy
+
+        # last frames of every operator [window, operators, 3, 42]
+        self._frames = np.zeros((window, num_operators, 3, 42), dtype=np.float32)
+        self._num_frames = 0
+
+        # segmentations decided by the prefilter and segmentations requested, since the last reset of the counters
+        self.decided = 0
+        self.total = 0
+
+    def add(self, frame: np.array) -> None:
+        """
+        Add the landmarks of a frame.
+
+        :param frame: normalised landmarks with shape [operators, 3, 42], copied
+        """
+        np.copyto(self._frames[:-1], self._frames[1:])
+        np.copyto(self._frames[-1], frame)
+        self._num_frames += 1
+
+    def classify(self, operators: np.array) -> np.array:
+        """
+        Segment the operators whose hands are clearly moving or static.
+
+        :param operators: boolean mask of the operators to segment
+        :return: segmentation of each operator, human movement (0), static (1) or NaN if the ensemble has to decide
+        """
+        labels = np.full(len(operators), np.nan, dtype=np.float32)
+        self.total += int(operators.sum())
+
+        # undecided until the window is filled
+        if self._num_frames < len(self._frames):
+            return labels
+
+        energy = get_velocity_energy(self._frames)
+        labels[operators & (energy <= self._static_energy)] = 1
+        labels[operators & (energy >= self._moving_energy)] = 0
+        self.decided += int((~np.isnan(labels)).sum())
+        return labels
+
+    def reset(self) -> None:
+        """
+        Forget the previous frames, e.g. when the sequences are no longer continuous.
+        """
+        self._num_frames = 0
+
+    def reset_counters(self) -> None:
+        """
+        Reset the decision counters.
+        """
+        self.decided = 0
+        self.total = 0
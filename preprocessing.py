@@ -0,0 +1,152 @@
+import os
+import tracemalloc
+import numpy as np
+from frame_sampler import get_visible_hands
+
+
+def load_normalisation_vectors() -> tuple:
+    """
+    Load the vectors used to normalise landmarks.
+
+    :return: minimum and maximum vectors with shape [3, 42]
+    """
+    min_vector = np.transpose(np.load(os.path.join("settings", "min_vector.npy")).reshape((-1, 3)))
+    max_vector = np.transpose(np.load(os.path.join("settings", "max_vector.npy")).reshape((-1, 3)))
+    return min_vector, max_vector
+
+def normalise_hand_poses(hand_poses: np.array, min_vector: np.array, max_vector: np.array) -> np.array:
+    """
+    Normalise detected hands to [0, 1], hands not yet detected are kept as zeros.
+
+    :param hand_poses: landmarks with shape [..., 3, 42]
+    :param min_vector: minimum vector with shape [3, 42]
+    :param max_vector: maximum vector with shape [3, 42]
+    :return: normalised landmarks
+    """
+    # mask hands that were detected (hands not yet detected are represented as zeros)
+    mask = hand_poses.sum(axis=-2, keepdims=True) > 0.001
+
+    # normalise detected hands
+    return np.where(mask, np.clip((hand_poses - min_vector) / (max_vector - min_vector), 0, 1), hand_poses)
+
+# normalisation of the landmarks of single frames into preallocated float32 buffers, no array is allocated per frame
+class LandmarkPreprocessor:
+    def __init__(self, min_vector: np.array, max_vector: np.array, landmark_shape: tuple = (3, 42)):
+        # minimum and reciprocal range are computed once, landmarks with an empty range are set to zero
+        self._min_vector = min_vector.astype(np.float32)
+        value_range = (max_vector - min_vector).astype(np.float32)
+        self._reciprocal_range = np.divide(1, value_range, out=np.zeros_like(value_range), where=value_range != 0)
+
+        # output and intermediate buffers, landmarks of several operators share the vectors
+        self._output = np.empty(landmark_shape, dtype=np.float32)
+        self._landmark_sums = np.empty(landmark_shape[:-2] + (1, landmark_shape[-1]), dtype=np.float32)
+        self._missing = np.empty(self._landmark_sums.shape, dtype=bool)
+
+    def normalise(self, hand_poses: np.array) -> np.array:
+        """
+        Normalise detected hands to [0, 1], hands not yet detected are kept as zeros.
+
+        :param hand_poses: float32 landmarks with the shape given to the preprocessor, e.g. [3, 42] or [operators, 3, 42]
+        :return: normalised landmarks, a buffer overwritten by the next call
+        """
+        # mask landmarks that were not detected (hands not yet detected are represented as zeros)
+        np.sum(hand_poses, axis=-2, keepdims=True, out=self._landmark_sums)
+        np.less_equal(self._landmark_sums, 0.001, out=self._missing)
+
+        # normalise in place and restore the landmarks that were not detected
+        np.subtract(hand_poses, self._min_vector, out=self._output)
+        np.multiply(self._output, self._reciprocal_range, out=self._output)
+        np.maximum(self._output, 0, out=self._output)
+        np.minimum(self._output, 1, out=self._output)
+        np.copyto(self._output, hand_poses, where=self._missing)
+        return self._output
+
+# affine transform of the landmarks of a camera into the image coordinates of the reference camera
+class CameraCalibration:
+    def __init__(self, transform: np.array = None):
+        # 4x4 homogeneous transform of (x, y, z), identity for the reference camera
+        transform = np.eye(4, dtype=np.float32) if transform is None else np.asarray(transform, dtype=np.float32)
+        if transform.shape != (4, 4):
+            raise ValueError(f"Calibration transform must have shape (4, 4), not {transform.shape}")
+        self._rotation = transform[:3, :3]
+        self._translation = transform[:3, 3:]
+        self.identity = np.allclose(transform, np.eye(4))
+
+    @staticmethod
+    def load(path: str = None):
+        """
+        Load the calibration of a camera.
+
+        :param path: .npy file with a 4x4 transform, None for the identity
+        :return: camera calibration
+        """
+        return CameraCalibration(None if path is None else np.load(path))
+
+    def apply(self, hand_poses: np.array, confidence: np.array) -> tuple:
+        """
+        Transform detected hands into the reference coordinates, hands not yet detected are kept as zeros.
+        Left and right hands are swapped if needed, so hand identity follows the x order of the reference camera.
+
+        :param hand_poses: landmarks with shape [3, 42]
+        :param confidence: confidence of the left and right hands
+        :return: tuple (transformed landmarks, confidence)
+        """
+        if self.identity:
+            return hand_poses, confidence
+
+        visible = get_visible_hands(hand_poses)
+        transformed = self._rotation @ hand_poses + self._translation
+        hand_poses = np.where(np.repeat(visible, 21), transformed, hand_poses).astype(np.float32)
+
+        # same rule as the hand tracker, the left hand has the larger x coordinate
+        if visible.all() and hand_poses[0, 0] + hand_poses[0, 9] < hand_poses[0, 21] + hand_poses[0, 30]:
+            hand_poses = np.concatenate((hand_poses[:, 21:], hand_poses[:, :21]), axis=1)
+            confidence = confidence[::-1].copy()
+        return hand_poses, confidence
+
+# measures the memory allocated temporarily while frames are processed, using tracemalloc
+class AllocationMonitor:
+    def __init__(self, enabled: bool):
+        # tracing slows down every allocation, so it only runs when profiling
+        self.enabled = enabled
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._baseline = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Reset the statistics.
+        """
+        self._frames = 0
+        self._peak_sum = 0
+        self._peak_max = 0
+
+    def begin(self) -> None:
+        """
+        Start measuring the allocations of a processing step.
+        """
+        if self.enabled:
+            tracemalloc.reset_peak()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+
+    def end(self, frames: int) -> None:
+        """
+        Finish measuring the allocations of a processing step.
+
+        :param frames: number of frames processed in the step, steps without frames are ignored
+        """
+        if self.enabled and frames > 0:
+            peak = tracemalloc.get_traced_memory()[1] - self._baseline
+            self._frames += frames
+            self._peak_sum += peak
+            self._peak_max = max(self._peak_max, peak)
+
+    def summary(self) -> str:
+        """
+        Describe the allocations measured since the last reset.
+
+        :return: mean and maximum memory allocated per frame above the memory in use before the step
+        """
+        return f"allocated {self._peak_sum / max(self._frames, 1) / 1024:.1f} KiB per frame " \
+               f"(max {self._peak_max / 1024:.1f} KiB per step)"
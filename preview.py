@@ -0,0 +1,42 @@
+import logging
+import cv2 as cv
+from shared_frames import FrameBus
+
+
+logger = logging.getLogger("preview")
+
+def preview_loop(frame_bus: FrameBus, stop_event):
+    """
+    Preview process, shows the newest camera frame published on the frame bus.
+
+    :param frame_bus: bus where the camera process publishes its frames
+    :param stop_event: event to stop the process
+    """
+    last_sequence = -1
+    shown_frames = 0
+    try:
+        while not stop_event.is_set():
+            frame = frame_bus.acquire(last_sequence, timeout=0.1)
+            if frame is None:
+                continue
+            sequence, frame_number, timestamp, rgb_frame = frame
+
+            # the view is only read while the frame is referenced, conversion copies it
+            try:
+                bgr_frame = cv.cvtColor(rgb_frame, cv.COLOR_RGB2BGR)
+            finally:
+                frame_bus.release(sequence)
+
+            # frames published meanwhile are skipped, the preview always shows the newest one
+            last_sequence = sequence
+            shown_frames += 1
+            cv.putText(bgr_frame, f"frame {frame_number}  t = {timestamp:.2f} s", (10, 30), cv.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+            cv.imshow("Camera preview", bgr_frame)
+            cv.waitKey(1)
+
+    except Exception:
+        logger.error("Preview error", exc_info=True)
+    finally:
+        cv.destroyAllWindows()
+        frame_bus.close()
+        logger.info(f"Preview stopped after {shown_frames} frames")
@@ -0,0 +1,217 @@
+import collections
+import logging
+import os
+import threading
+import time
+import cv2 as cv
+from settings import constants
+from shared_frames import FrameBus
+
+
+# logger of the recorder process, its file is only opened by the recorder process
+logger = logging.getLogger("recorder")
+
+# bounded buffer between the frame reader and the encoder, the oldest frame is dropped when full
+class DropOldestBuffer:
+    def __init__(self, capacity: int):
+        self._frames = collections.deque(maxlen=capacity)
+        self._condition = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, frame) -> None:
+        """
+        Add a frame, dropping the oldest frame if the buffer is full.
+
+        :param frame: frame and its information
+        """
+        with self._condition:
+            if len(self._frames) == self._frames.maxlen:
+                self.dropped += 1
+            self._frames.append(frame)
+            self._condition.notify()
+
+    def get(self, timeout: float):
+        """
+        Take the oldest frame.
+
+        :param timeout: maximum waiting time [s]
+        :return: oldest frame or None on timeout or when the buffer was closed and is empty
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._closed or self._frames, timeout)
+            return self._frames.popleft() if self._frames else None
+
+    def close(self) -> None:
+        """
+        Wake up the waiting thread, frames already buffered can still be taken.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+# video segments of a recording session, each with an index file matching its frames to the landmark stream
+class SegmentWriter:
+    def __init__(self, directory: str, fps: float, segment_length: float, max_segments: int, codec: str):
+        self._directory = directory
+        self._fps = fps
+        self._segment_length = segment_length
+        self._max_segments = max_segments
+        self._fourcc = cv.VideoWriter_fourcc(*codec)
+        self._session = time.strftime("%Y%m%d_%H%M%S")
+        self._segments = collections.deque()
+        self._video = None
+        self._index = None
+        self._segment_start = None
+        self._segment_frames = 0
+        self._segment_count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, bgr_frame, frame_number: int, timestamp: float) -> None:
+        """
+        Encode a frame, starting a new segment once the current one reaches the segment length.
+
+        :param bgr_frame: frame to encode
+        :param frame_number: capture sequence number of the frame
+        :param timestamp: capture timestamp of the frame [s]
+        """
+        if self._video is None or timestamp - self._segment_start >= self._segment_length:
+            self._open_segment(bgr_frame.shape, timestamp)
+
+        self._video.write(bgr_frame)
+        self._index.write(f"{self._segment_frames},{frame_number},{timestamp:.6f}\n")
+        self._segment_frames += 1
+
+    def _open_segment(self, frame_shape: tuple, timestamp: float) -> None:
+        """
+        Close the current segment, open the next one and remove segments beyond the maximum number.
+
+        :param frame_shape: shape of the frames of the segment
+        :param timestamp: capture timestamp of the first frame of the segment [s]
+        """
+        self.close()
+        path = os.path.join(self._directory, f"{self._session}_{self._segment_count:04d}")
+        self._video = cv.VideoWriter(path + ".mp4", self._fourcc, self._fps, (frame_shape[1], frame_shape[0]))
+        if not self._video.isOpened():
+            raise IOError(f"Video segment {path}.mp4 could not be opened")
+        self._index = open(path + ".csv", "w")
+        self._index.write("segment_frame,frame_number,timestamp\n")
+        self._segment_start = timestamp
+        self._segment_frames = 0
+        self._segment_count += 1
+
+        # rolling set of segments, the oldest ones are removed
+        self._segments.append(path)
+        while len(self._segments) > self._max_segments:
+            old_path = self._segments.popleft()
+            for extension in [".mp4", ".csv"]:
+                if os.path.exists(old_path + extension):
+                    os.remove(old_path + extension)
+        logger.debug(f"Recording segment {path}.mp4")
+
+    def close(self) -> None:
+        """
+        Finish the current segment.
+        """
+        if self._video is not None:
+            self._video.release()
+            self._index.close()
+            self._video = None
+            self._index = None
+
+def read_frames(frame_bus: FrameBus, frame_buffer: DropOldestBuffer, stop_event, statistics: dict) -> None:
+    """
+    Reader thread, copies frames of the frame bus into the buffer and releases them immediately.
+
+    :param frame_bus: bus where the camera process publishes its frames
+    :param frame_buffer: buffer read by the encoder
+    :param stop_event: event to stop the thread
+    :param statistics: counters of the recorder, the thread adds the frames it missed on the bus
+    """
+    last_sequence = -1
+    try:
+        while not stop_event.is_set() and not frame_buffer.closed:
+            # oldest frame still on the bus, so every frame is recorded while the reader keeps up
+            frame = frame_bus.acquire(last_sequence, timeout=0.1, latest=False)
+            if frame is None:
+                continue
+            sequence, frame_number, timestamp, rgb_frame = frame
+
+            # downscale while converting, the copy releases the bus slot right away
+            try:
+                if constants.RECORDING_SCALE != 1.0:
+                    rgb_frame = cv.resize(rgb_frame, None, fx=constants.RECORDING_SCALE, fy=constants.RECORDING_SCALE, interpolation=cv.INTER_AREA)
+                bgr_frame = cv.cvtColor(rgb_frame, cv.COLOR_RGB2BGR)
+            finally:
+                frame_bus.release(sequence)
+
+            # frames overwritten on the bus before they were read
+            if last_sequence >= 0:
+                statistics["missed"] += sequence - last_sequence - 1
+            last_sequence = sequence
+
+            frame_buffer.put((bgr_frame, frame_number, timestamp))
+    except Exception:
+        logger.error("Recorder reader error", exc_info=True)
+    finally:
+        frame_buffer.close()
+
+def recorder_loop(frame_bus: FrameBus, stop_event):
+    """
+    Recorder process, encodes the frames of the frame bus into a rolling set of video segments.
+    Each segment has an index file with the capture sequence number and timestamp of its frames.
+
+    :param frame_bus: bus where the camera process publishes its frames
+    :param stop_event: event to stop the process
+    """
+    # define logging file for the recorder process
+    logging.basicConfig(level=logging.DEBUG if constants.DEBUG else logging.INFO, format='[%(asctime)s] [%(name)s] %(message)s')
+    file_handler = logging.FileHandler("recorder.log")
+    formatter = logging.Formatter('[%(asctime)s] [%(name)s] %(message)s')
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+    frame_buffer = DropOldestBuffer(constants.RECORDING_BUFFER_SIZE)
+    statistics = {"missed": 0}
+    reader_thread = threading.Thread(target=read_frames, args=(frame_bus, frame_buffer, stop_event, statistics), daemon=True)
+    writer = None
+
+    try:
+        writer = SegmentWriter(constants.RECORDING_DIR, constants.STREAM_FPS, constants.RECORDING_SEGMENT_LENGTH,
+                               constants.RECORDING_MAX_SEGMENTS, constants.RECORDING_CODEC)
+        reader_thread.start()
+        logger.info(f"Recording to {constants.RECORDING_DIR}")
+
+        last_heartbeat = time.time()
+        recorded_frames = 0
+        while True:
+            frame = frame_buffer.get(timeout=0.1)
+            if frame is None:
+                # the reader closes the buffer when it stops
+                if not reader_thread.is_alive():
+                    break
+            else:
+                writer.write(*frame)
+                recorded_frames += 1
+
+            if time.time() - last_heartbeat > 5:
+                logger.info(f"Recorder running... recorded {recorded_frames} frames, dropped {frame_buffer.dropped} "
+                            f"in the buffer, missed {statistics['missed']} on the frame bus")
+                last_heartbeat = time.time()
+                recorded_frames = 0
+
+    except Exception:
+        logger.error("Recorder error", exc_info=True)
+    finally:
+        frame_buffer.close()
+        if reader_thread.is_alive():
+            reader_thread.join(timeout=2)
+        if writer is not None:
+            writer.close()
+        frame_bus.close()
+        logger.info(f"Recorder stopped, dropped {frame_buffer.dropped} frames in the buffer, "
+                    f"missed {statistics['missed']} on the frame bus")
@@ -15,7 +15,20 @@ formatter = logging.Formatter('[%(asctime)s] [%(name)s] %(message)s')
 file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 
-def robot_loop(result_queue, stop_event, robot_online_event, moving_flag):
+def get_task_time(task: str) -> float:
+    """
+    Get the expected duration of a robot task.
+    :param task: task label, labels of sub-assemblies with several tasks end with the task number (e.g. H1)
+    :return: expected duration of the task [s], None if the duration was not measured (placeholder time)
+    """
+    if task in constants.ROBOT_TASK_TIME:
+        task_time = constants.ROBOT_TASK_TIME[task][0]
+    else:
+        label = task.rstrip("0123456789")
+        task_time = constants.ROBOT_TASK_TIME[label][int(task[len(label):]) - 1]
+    return None if task_time >= constants.ROBOT_PLACEHOLDER_TASK_TIME else task_time
+
+def robot_loop(result_queue, stop_event, robot_online_event, moving_flag, motion_end):
     def load_tasks(robotic_system: RoboticSystem, tasks: list):
         """
         Load tasks executed by the robot.
@@ -88,9 +101,13 @@ def robot_loop(result_queue, stop_event, robot_online_event, moving_flag):
                     logger.warning(f"Drop wheel task failed! Task selected {task_class}! Shutting system down")
                     break
 
-                # execute classified task
+                # execute classified task, publishing when it is expected to end,
+                # tasks without a measured duration are tracked at full rate (end in the past)
+                task = robot_tasks_remaining[task_class].pop()
+                task_time = get_task_time(task)
+                motion_end.value = time.time() + task_time if task_time is not None else 0.0
                 logger.info("Starting robot movement")
-                robotic_system.run_task(robot_tasks_remaining[task_class].pop())
+                robotic_system.run_task(task)
                 logger.info("Robot movement stopped")
                 moving_flag.value = False
 
@@ -0,0 +1,42 @@
+import numpy as np
+import cv2 as cv
+from settings import constants
+
+
+# cheap detector of frames where nothing changed since the last tracked frame
+class SceneChangeDetector:
+    def __init__(self, threshold: float = constants.SCENE_CHANGE_THRESHOLD, max_reuses: int = constants.SCENE_MAX_REUSES,
+                 size: tuple = (80, 45)):
+        self._threshold = threshold
+        self._max_reuses = max_reuses
+        self._size = size
+
+        # downsampled current frame and downsampled last tracked frame
+        self._thumbnail = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        self._reference = None
+
+        # consecutive frames reported as static
+        self.reuses = 0
+
+    def is_static(self, rgb_frame: np.array) -> bool:
+        """
+        Check if a frame is effectively unchanged since the last tracked frame, at most max_reuses times in a row.
+        Frames not reported as static become the new reference.
+
+        :param rgb_frame: captured frame
+        :return: True if the landmarks of the last tracked frame can be reused
+        """
+        cv.resize(rgb_frame, self._size, dst=self._thumbnail, interpolation=cv.INTER_AREA)
+
+        # mean absolute difference of the downsampled frames, in intensity levels
+        if self._reference is not None and self.reuses < self._max_reuses:
+            difference = np.abs(self._thumbnail.astype(np.int16) - self._reference).mean()
+            if difference < self._threshold:
+                self.reuses += 1
+                return True
+
+        if self._reference is None:
+            self._reference = np.empty(self._thumbnail.shape, dtype=np.int16)
+        np.copyto(self._reference, self._thumbnail)
+        self.reuses = 0
+        return False
@@ -1,5 +1,6 @@
 # GENERIC SETTINGS
 DEBUG = False
+PROFILE_ALLOCATIONS = False
 
 # ASSEMBLY INFO
 EXPECTED_TASKS = {"B": 0, "D": 1, "H": 2, "MT": 3, "S": 4, "W": 5}
@@ -12,8 +13,104 @@ ARDUINO_BOARD = "Genuino Uno"
 STREAM_WIDTH = 1280
 STREAM_HEIGHT = 720
 STREAM_FPS = 30
+INFERENCE_SCALE = 1.0
+LANDMARK_BUFFER_SIZE = 64
 SKIP_FRAMES = 2
 
+# ADAPTIVE SAMPLING SETTINGS (skip fewer frames while hands move fast, velocities in normalised units per second)
+ADAPTIVE_SAMPLING = False
+SAMPLER_MIN_SKIP = 0
+SAMPLER_MAX_SKIP = 5
+SAMPLER_LOW_VELOCITY = 0.02
+SAMPLER_HIGH_VELOCITY = 0.3
+RESAMPLER_MAX_GAP = 1.0
+
+# HAND TRACKING SETTINGS
+HAND_TRACKING_WORKERS = 1
+MODEL_COMPLEXITY = 1
+HAND_TRACKING_MODE = "image"
+MIN_DETECTION_CONFIDENCE = 0.3
+MIN_TRACKING_CONFIDENCE = 0.3
+REDETECTION_INTERVAL = 30
+ROI_TRACKING = False
+ROI_PADDING = 0.1
+ROI_MAX_AREA = 0.6
+
+# OPERATOR SETTINGS (operators tracked at the station, each with a left and right hand; hands farther than the
+# association distance from every known operator, in normalised units, start a new operator)
+NUM_OPERATORS = 1
+OPERATOR_MAX_DISTANCE = 0.25
+
+# HAND BACKEND SETTINGS (mediapipe or onnx, the onnx backend runs exported MediaPipe palm detection and landmark models)
+HAND_BACKEND = "mediapipe"
+ONNX_PALM_MODEL = "models/hands/palm_detection.onnx"
+ONNX_LANDMARK_MODEL = "models/hands/hand_landmark.onnx"
+ONNX_THREADS = 2
+
+# STATIC SCENE SETTINGS (reuse landmarks while the downsampled frame changes less than the threshold, in intensity levels)
+STATIC_SCENE_DETECTION = False
+SCENE_CHANGE_THRESHOLD = 2.0
+SCENE_MAX_REUSES = 10
+
+# FRAME BUS SETTINGS (RGB frames shared with consumers other than hand tracking, e.g. the preview window;
+# slots held longer than FRAME_BUS_RECLAIM_TIMEOUT seconds are reclaimed, e.g. after a consumer crashed)
+FRAME_BUS_SLOTS = 4
+FRAME_BUS_RECLAIM_TIMEOUT = 2.0
+FRAME_PREVIEW = False
+
+# RECORDING SETTINGS (RGB video segments with index files matching their frames to the landmarks, lengths in seconds)
+RECORDING = False
+RECORDING_DIR = "recordings"
+RECORDING_SCALE = 0.5
+RECORDING_CODEC = "mp4v"
+RECORDING_BUFFER_SIZE = 30
+RECORDING_SEGMENT_LENGTH = 60
+RECORDING_MAX_SEGMENTS = 60
+
+# LATENCY GOVERNOR SETTINGS (step through the degradation levels while the end-to-end latency exceeds the budget, in seconds;
+# levels may set skip_frames, model_complexity, segmentation_models and classification_models)
+LATENCY_GOVERNOR = False
+LATENCY_BUDGET = 0.15
+GOVERNOR_INTERVAL = 2.0
+GOVERNOR_RECOVERY = 0.6
+DEGRADATION_LEVELS = [
+    {},
+    {"segmentation_models": 3},
+    {"segmentation_models": 3, "model_complexity": 0},
+    {"segmentation_models": 2, "model_complexity": 0, "classification_models": 3},
+    {"segmentation_models": 1, "model_complexity": 0, "classification_models": 3, "skip_frames": 5},
+]
+
+# MULTI-CAMERA SETTINGS (one camera process per entry, e.g. {"name": "side", "serial": "123456", "calibration": "settings/side.npy"}
+# or {"replay": "side.npy"}; the first camera is the reference, "calibration" is a 4x4 transform into its image coordinates)
+CAMERAS = []
+FUSION_MAX_OFFSET = 0.05
+FUSION_MAX_WAIT = 0.05
+
+# REPLAY SETTINGS (replace the camera by a video file or a .npy stack of BGR frames)
+REPLAY_PATH = None
+REPLAY_REALTIME = True
+
+# MODEL DEVICE SETTINGS (cuda or cpu; on the cpu PyTorch uses the given thread counts; the benchmark logs the latency
+# of each ensemble when the model process starts, delaying readiness)
+MODEL_DEVICE = "cuda"
+CPU_INTRA_OP_THREADS = 4
+CPU_INTER_OP_THREADS = 1
+MODEL_BENCHMARK = False
+MODEL_BENCHMARK_RUNS = 20
+
+# ENSEMBLE SETTINGS (run all members of an ensemble in one vectorized call over their stacked parameters,
+# members run one by one if disabled or if the vectorized call does not match them)
+VECTORIZED_ENSEMBLES = True
+
+# MODEL STARTUP SETTINGS (compile the ensembles with torchscript, compile (torch.compile) or None, run warm-up passes
+# before the system becomes ready, seconds the controller waits for readiness and seconds from the system start
+# the robot has to come online, at least 5 s after the models are ready)
+MODEL_COMPILE = None
+MODEL_WARMUP_RUNS = 3
+MODEL_READY_TIMEOUT = 60
+ROBOT_ONLINE_TIMEOUT = 15
+
 # CLASSIFICATION SETTINGS
 C_SEQ_LEN = 186
 C_NUM_BLOCKS = 8
@@ -38,4 +135,21 @@ S_FC_LAYERS = 1
 S_FC_UNITS = 128
 S_FC_DROPOUT = 0.2
 TIMING_WINDOW = 20
-TIMING_THRESHOLD = 0.5
\ No newline at end of file
+TIMING_THRESHOLD = 0.5
+
+# KINEMATIC PREFILTER SETTINGS (landmark velocity energy over the last frames, mean squared displacement per model frame of the
+# normalised landmarks; below the static threshold hands are static, above the moving threshold they move, calibrate_prefilter.py)
+KINEMATIC_PREFILTER = False
+PREFILTER_WINDOW = 5
+PREFILTER_STATIC_ENERGY = 1e-5
+PREFILTER_MOVING_ENERGY = 1e-3
+
+# ROBOT MOTION SETTINGS (hands are tracked at a keep-alive rate while the robot moves, full rate resumes
+# ROBOT_PREROLL_TIME seconds before the expected end of the robot task, the models wait for ROBOT_PREROLL_FRAMES frames,
+# a full classification sequence, and the pre-roll lasts that many frames at the model rate plus a margin;
+# tasks whose ROBOT_TASK_TIME is the placeholder ROBOT_PLACEHOLDER_TASK_TIME were not measured and are not gated)
+ROBOT_MOTION_GATING = False
+ROBOT_KEEP_ALIVE_SKIP_FRAMES = 29
+ROBOT_PLACEHOLDER_TASK_TIME = 1000
+ROBOT_PREROLL_FRAMES = C_SEQ_LEN
+ROBOT_PREROLL_TIME = ROBOT_PREROLL_FRAMES * (SKIP_FRAMES + 1) / STREAM_FPS + 1.0
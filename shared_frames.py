@@ -0,0 +1,236 @@
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# preallocated frame slots in shared memory, slots are handed out by the process that created the pool
+class SharedFramePool:
+    def __init__(self, num_slots: int, frame_shape: tuple):
+        self.num_slots = num_slots
+        self.frame_shape = tuple(frame_shape)
+        self._shm = shared_memory.SharedMemory(create=True, size=num_slots * int(np.prod(self.frame_shape)))
+        self._owner_pid = os.getpid()
+        self._attach_views()
+
+    def _attach_views(self) -> None:
+        """
+        Create NumPy views over the shared memory block.
+        """
+        self._frames = np.ndarray((self.num_slots,) + self.frame_shape, dtype=np.uint8, buffer=self._shm.buf)
+
+    def __getstate__(self):
+        # only the shared memory name is sent to child processes, views are recreated on attach
+        return {"name": self._shm.name, "num_slots": self.num_slots, "frame_shape": self.frame_shape}
+
+    def __setstate__(self, state):
+        self.num_slots = state["num_slots"]
+        self.frame_shape = state["frame_shape"]
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._owner_pid = None
+        self._attach_views()
+
+    def get(self, slot: int) -> np.array:
+        """
+        Get a frame slot.
+
+        :param slot: slot index
+        :return: view of the frame stored in the slot
+        """
+        return self._frames[slot]
+
+    def put(self, slot: int, frame: np.array) -> None:
+        """
+        Copy a frame into a slot.
+
+        :param slot: slot index
+        :param frame: frame with the pool frame shape
+        """
+        np.copyto(self._frames[slot], frame)
+
+    def close(self) -> None:
+        """
+        Release the views and close the shared memory block, the creator also removes it.
+        """
+        self._frames = None
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
+
+# ring of frame slots in shared memory, published once by a single producer and read zero-copy by any number of consumers
+class FrameBus:
+    # size reserved for the header, keeps the slots aligned
+    _HEADER_SIZE = 64
+
+    # maximum time the producer waits for the lock [s], a consumer killed while holding it never releases it
+    _LOCK_TIMEOUT = 0.005
+
+    def __init__(self, num_slots: int, max_frame_shape: tuple, reclaim_timeout: float = 2.0):
+        self.num_slots = num_slots
+        self.slot_size = int(np.prod(max_frame_shape))
+        self._slot_dtype = self._get_slot_dtype()
+
+        # slots referenced longer than this [s] are taken back by the producer when every slot is referenced,
+        # a consumer that dies while holding a slot would otherwise remove it from the ring
+        self._reclaim_timeout = reclaim_timeout
+
+        # shared memory block with a header (number of published frames), the slot metadata and the frame data
+        self._shm = shared_memory.SharedMemory(create=True, size=self._HEADER_SIZE + num_slots * (self._slot_dtype.itemsize + self.slot_size))
+        self._owner_pid = os.getpid()
+        self._attach_views()
+        self._published[0] = 0
+        self._slots["sequence"] = -1
+        self._slots["references"] = 0
+        self._slots["acquired"] = 0
+
+        # lock protecting the reference counts, only held for a few operations, condition wakes up consumers
+        self._condition = mp.Condition()
+
+        # frames the producer dropped because every slot was referenced by consumers, and slots it reclaimed
+        self.dropped = 0
+        self.reclaimed = 0
+
+    @staticmethod
+    def _get_slot_dtype() -> np.dtype:
+        """
+        Memory layout of the metadata of a single slot.
+
+        :return: structured dtype of the slot metadata
+        """
+        return np.dtype([("sequence", np.int64), ("frame_number", np.int64), ("timestamp", np.float64),
+                         ("acquired", np.float64), ("references", np.int32), ("shape", np.int32, 3)], align=True)
+
+    def _attach_views(self) -> None:
+        """
+        Create NumPy views over the shared memory block.
+        """
+        self._published = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._slots = np.ndarray((self.num_slots,), dtype=self._slot_dtype, buffer=self._shm.buf, offset=self._HEADER_SIZE)
+        self._data = np.ndarray((self.num_slots, self.slot_size), dtype=np.uint8, buffer=self._shm.buf,
+                                offset=self._HEADER_SIZE + self._slots.nbytes)
+
+    def __getstate__(self):
+        # only the shared memory name is sent to child processes, views are recreated on attach
+        return {"name": self._shm.name, "num_slots": self.num_slots, "slot_size": self.slot_size,
+                "reclaim_timeout": self._reclaim_timeout, "condition": self._condition}
+
+    def __setstate__(self, state):
+        self.num_slots = state["num_slots"]
+        self.slot_size = state["slot_size"]
+        self._reclaim_timeout = state["reclaim_timeout"]
+        self._slot_dtype = self._get_slot_dtype()
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._owner_pid = None
+        self._attach_views()
+        self._condition = state["condition"]
+        self.dropped = 0
+        self.reclaimed = 0
+
+    def publish(self, frame: np.array, timestamp: float, frame_number: int) -> int:
+        """
+        Copy a frame into the next slot no consumer references. Only one process may publish.
+        The frame is dropped instead of waiting if every slot is referenced or the lock is not available within the
+        lock timeout, so consumers never stall the producer.
+        Slots still referenced longer than the reclaim timeout after they were acquired are released first.
+
+        :param frame: uint8 frame no larger than the maximum frame shape
+        :param timestamp: capture timestamp of the frame [s]
+        :param frame_number: capture sequence number of the frame, matches the landmark stream
+        :return: bus sequence number of the published frame or -1 if it was dropped
+        """
+        if frame.size > self.slot_size:
+            raise ValueError(f"Frame with shape {frame.shape} does not fit a slot of {self.slot_size} bytes")
+
+        sequence = int(self._published[0])
+
+        # claim the oldest unreferenced slot, invalidating it so it can no longer be acquired
+        if not self._condition.acquire(timeout=self._LOCK_TIMEOUT):
+            self.dropped += 1
+            return -1
+        try:
+            # slots held too long belong to consumers that died (or stalled) without releasing them
+            stale = (self._slots["references"] > 0) & (time.monotonic() - self._slots["acquired"] > self._reclaim_timeout)
+            if stale.any():
+                self._slots["references"][stale] = 0
+                self._slots["sequence"][stale] = -1
+                self.reclaimed += int(stale.sum())
+
+            free = np.flatnonzero(self._slots["references"] == 0)
+            if len(free) == 0:
+                self.dropped += 1
+                return -1
+            index = free[np.argmin(self._slots["sequence"][free])]
+            slot = self._slots[index]
+            slot["sequence"] = -1
+        finally:
+            self._condition.release()
+
+        # copy outside the lock, the slot is not visible to consumers meanwhile
+        np.copyto(self._data[index, :frame.size].reshape(frame.shape), frame)
+        slot["shape"] = frame.shape if frame.ndim == 3 else frame.shape + (1,)
+        slot["timestamp"] = timestamp
+        slot["frame_number"] = frame_number
+
+        # publish slot and wake up waiting consumers, an unpublished slot stays free for the next frame
+        if not self._condition.acquire(timeout=self._LOCK_TIMEOUT):
+            self.dropped += 1
+            return -1
+        try:
+            slot["sequence"] = sequence
+            self._published[0] = sequence + 1
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+        return sequence
+
+    def acquire(self, after_sequence: int = -1, timeout: float = 0.0, latest: bool = True):
+        """
+        Reference a frame published after the given sequence, it stays valid until released.
+        Every acquired frame must be released, referenced slots are only overwritten after the reclaim timeout.
+
+        :param after_sequence: bus sequence of the last frame the consumer read
+        :param timeout: maximum waiting time for a new frame [s]
+        :param latest: True to get the newest frame, False to get the oldest frame still available
+        :return: tuple (bus sequence, frame number, timestamp, frame view) or None if no new frame was published
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._published[0] - 1 > after_sequence, timeout):
+                return None
+
+            # candidate slots holding frames published after the given sequence
+            slots = [index for index in range(self.num_slots) if self._slots[index]["sequence"] > after_sequence]
+            if not slots:
+                return None
+            select = max if latest else min
+            index = select(slots, key=lambda i: self._slots[i]["sequence"])
+            slot = self._slots[index]
+            slot["references"] += 1
+            slot["acquired"] = time.monotonic()
+
+            shape = tuple(int(size) for size in slot["shape"])
+            frame = self._data[index, :int(np.prod(shape))].reshape(shape)
+            return int(slot["sequence"]), int(slot["frame_number"]), float(slot["timestamp"]), frame
+
+    def release(self, sequence: int) -> None:
+        """
+        Release a frame acquired by this consumer.
+
+        :param sequence: bus sequence returned by acquire
+        """
+        with self._condition:
+            for slot in self._slots:
+                if slot["sequence"] == sequence and slot["references"] > 0:
+                    slot["references"] -= 1
+                    return
+
+    def close(self) -> None:
+        """
+        Release the views and close the shared memory block, the creator also removes it.
+        """
+        self._published = None
+        self._slots = None
+        self._data = None
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
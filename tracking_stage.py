@@ -0,0 +1,222 @@
+import multiprocessing as mp
+import queue
+import logging
+import traceback
+import numpy as np
+from settings import constants
+from handtracker import HandTracker
+from shared_frames import SharedFramePool
+
+
+logger = logging.getLogger("camera")
+
+# hand tracking in the camera process, each frame is tracked when submitted
+class InlineTrackingStage:
+    def __init__(self, hand_tracker: HandTracker):
+        self._hand_tracker = hand_tracker
+        self._results = []
+
+    @property
+    def idle(self) -> bool:
+        return not self._results
+
+    def has_capacity(self) -> bool:
+        """
+        Check if another frame can be submitted.
+
+        :return: True if a frame can be submitted
+        """
+        return True
+
+    def submit(self, rgb_frame: np.array, metadata: tuple) -> None:
+        """
+        Track hands in a frame.
+
+        :param rgb_frame: frame to calculate hand landmarks, None to reuse the landmarks of the previous frame
+        :param metadata: frame information returned with its landmarks
+        """
+        if rgb_frame is None:
+            self._results.append((None, None, metadata))
+            return
+        hand_poses = self._hand_tracker.get_hand_poses_from_frame(rgb_frame)
+        self._results.append((hand_poses, self._hand_tracker.hand_confidence.copy(), metadata))
+
+    def collect(self, timeout: float) -> list:
+        """
+        Get the landmarks of tracked frames in submission order.
+
+        :param timeout: maximum waiting time for a result [s]
+        :return: list of tuples (hand poses, hand confidence, metadata), hand poses and confidence are None for reused frames
+        """
+        results, self._results = self._results, []
+        return results
+
+    def set_model_complexity(self, model_complexity: int) -> None:
+        """
+        Change the landmark model complexity of the hand tracker.
+
+        :param model_complexity: 0 (lite) or 1 (full)
+        """
+        self._hand_tracker.set_model_complexity(model_complexity)
+
+    def close(self) -> None:
+        pass
+
+def tracking_worker(frame_pool: SharedFramePool, task_queue, result_queue, model_complexity):
+    """
+    Hand tracking worker process, detects hands in frames stored in the shared frame pool.
+
+    :param frame_pool: shared memory frame slots
+    :param task_queue: queue with (slot, order) tasks, None stops the worker
+    :param result_queue: queue where (slot, order, detected hands, detection scores, error) results are put,
+        error is None or the traceback of the exception that stopped the worker
+    :param model_complexity: shared landmark model complexity, followed before each task
+    """
+    slot, order = None, None
+    try:
+        # frames of a worker are not consecutive, so each one is tracked on its own
+        hand_tracker = HandTracker(mode="image", roi_tracking=False, model_complexity=model_complexity.value)
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            slot, order = task
+            hand_tracker.set_model_complexity(model_complexity.value)
+            rgb_frame = hand_tracker.prepare_frame(frame_pool.get(slot))
+            hands = hand_tracker.detect_hands(rgb_frame)
+            result_queue.put((slot, order, hands, hand_tracker.detection_scores, None))
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        # report the error to the camera process, which would otherwise wait for the result forever
+        result_queue.put((slot, order, None, None, traceback.format_exc()))
+    finally:
+        frame_pool.close()
+
+# hand tracking in a pool of worker processes, results are reassembled in submission order
+class PoolTrackingStage:
+    def __init__(self, hand_tracker: HandTracker, num_workers: int, frame_shape: tuple):
+        # hand identity (left and right hands) is resolved centrally, in submission order
+        self._hand_tracker = hand_tracker
+
+        # two slots per worker, so a frame can be copied while the previous one is tracked
+        self._frame_pool = SharedFramePool(2 * num_workers, frame_shape)
+        self._free_slots = list(range(self._frame_pool.num_slots))
+
+        # workers are spawned, forking would copy the capture thread and the MediaPipe graph of this process
+        context = mp.get_context("spawn")
+        self._task_queue = context.Queue()
+        self._result_queue = context.Queue()
+        self._model_complexity = context.Value("i", hand_tracker.model_complexity)
+        self._workers = []
+        for _ in range(num_workers):
+            worker = context.Process(target=tracking_worker, args=(self._frame_pool, self._task_queue, self._result_queue,
+                                                                   self._model_complexity), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Hand tracking with {num_workers} worker processes")
+
+        # metadata of submitted frames and detections received out of order
+        self._metadata = {}
+        self._detections = {}
+        self._next_submit = 0
+        self._next_collect = 0
+
+    @property
+    def idle(self) -> bool:
+        return self._next_collect == self._next_submit
+
+    def has_capacity(self) -> bool:
+        self._check_workers()
+        return len(self._free_slots) > 0
+
+    def _check_workers(self) -> None:
+        """
+        Check that every worker is still running, results of a dead worker would never arrive.
+        """
+        for worker in self._workers:
+            if not worker.is_alive():
+                # a worker that caught an exception reported it before exiting
+                try:
+                    while True:
+                        error = self._result_queue.get_nowait()[-1]
+                        if error is not None:
+                            raise RuntimeError(f"Hand tracking worker failed:\n{error}")
+                except queue.Empty:
+                    pass
+                raise RuntimeError(f"Hand tracking worker {worker.pid} stopped with exit code {worker.exitcode}")
+
+    def submit(self, rgb_frame: np.array, metadata: tuple) -> None:
+        # reused frames are complete without a worker, but still released in order
+        self._metadata[self._next_submit] = metadata
+        if rgb_frame is None:
+            self._detections[self._next_submit] = None
+            self._next_submit += 1
+            return
+
+        # copy frame to a free slot and send it to the workers
+        slot = self._free_slots.pop()
+        self._frame_pool.put(slot, rgb_frame)
+        self._task_queue.put((slot, self._next_submit))
+        self._next_submit += 1
+
+    def collect(self, timeout: float) -> list:
+        if self.idle:
+            return []
+        self._check_workers()
+
+        # receive detections, waiting only for the first one and only if the next result is missing
+        if self._next_collect in self._detections:
+            timeout = 0
+        received = []
+        try:
+            received.append(self._result_queue.get(timeout=timeout) if timeout > 0 else self._result_queue.get_nowait())
+            while True:
+                received.append(self._result_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        for slot, order, hands, scores, error in received:
+            if error is not None:
+                raise RuntimeError(f"Hand tracking worker failed:\n{error}")
+            self._free_slots.append(slot)
+            self._detections[order] = (hands, scores)
+
+        # release results in submission order, assigning left and right hands
+        results = []
+        while self._next_collect in self._detections:
+            detections = self._detections.pop(self._next_collect)
+            metadata = self._metadata.pop(self._next_collect)
+            if detections is None:
+                results.append((None, None, metadata))
+            else:
+                hand_poses = self._hand_tracker.get_hand_poses_from_detections(*detections)
+                results.append((hand_poses, self._hand_tracker.hand_confidence.copy(), metadata))
+            self._next_collect += 1
+        return results
+
+    def set_model_complexity(self, model_complexity: int) -> None:
+        # workers follow the shared value before their next task
+        self._model_complexity.value = model_complexity
+
+    def close(self) -> None:
+        # stop workers and release the frame slots
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+        self._frame_pool.close()
+
+def create_tracking_stage(hand_tracker: HandTracker, frame_shape: tuple):
+    """
+    Create the tracking stage selected in the settings.
+
+    :param hand_tracker: hand tracker used to track or, with workers, to assign hands
+    :param frame_shape: shape of the RGB frames
+    :return: pool stage if HAND_TRACKING_WORKERS > 1, inline stage otherwise
+    """
+    if constants.HAND_TRACKING_WORKERS > 1:
+        return PoolTrackingStage(hand_tracker, constants.HAND_TRACKING_WORKERS, frame_shape)
+    return InlineTrackingStage(hand_tracker)